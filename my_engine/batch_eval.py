@@ -0,0 +1,92 @@
+# eval_piece_vals for many positions at once, for scoring FEN collections
+# offline. Positions become rows of a 0/1 matrix with a column per
+# piece_index * 64 + square, and are scored with one matrix product against
+# the value tables.
+import chess
+import numpy as np
+from typing import Iterable, Sequence
+
+from my_engine.eval_piece_vals import mg_flat, eg_flat, game_phase_flat, piece_index
+
+feature_count = 12 * 64
+# positions scored at a time, to bound the size of the feature matrix
+batch_rows = 1 << 14
+
+# Columns: mg value, eg value and game phase weight of each feature. All are
+# small ints, so their products with the 0/1 features sum exactly even in
+# float32 (every partial sum stays far below 2 ** 24), in whatever order the
+# matrix product adds them up.
+weights = np.array([[mg_flat[idx], eg_flat[idx], game_phase_flat[idx // 64 % 6 + 1]]
+                    for idx in range(feature_count)], dtype=np.float32)
+
+# piece_index by FEN letter, -1 for empty squares
+fen_codes = np.full(256, -1, dtype=np.int64)
+for color in chess.COLORS:
+    for piece_type in chess.PIECE_TYPES:
+        fen_codes[ord(chess.Piece(piece_type, color).symbol())] = piece_index(piece_type, color)
+# digits become that many empty squares and ranks run together, so each
+# placement is 64 characters from a8 to h1
+expand_placement = str.maketrans({**{str(n): "." * n for n in range(1, 9)}, "/": ""})
+
+# (N, 64) piece_index of the piece on each square, or -1.
+def fen_squares(fens: Sequence[str]) -> np.ndarray:
+    placements = "".join(fen.split(" ", 1)[0].translate(expand_placement) for fen in fens)
+    chars = np.frombuffer(placements.encode("ascii"), dtype=np.uint8).reshape(len(fens), 64)
+    # character i of a placement is square i ^ 56
+    return fen_codes[chars][:, np.arange(64) ^ 56]
+
+def square_features(squares: np.ndarray) -> np.ndarray:
+    features = np.zeros((len(squares), feature_count), dtype=np.float32)
+    rows, square_idx = np.nonzero(squares >= 0)
+    features[rows, squares[rows, square_idx] * 64 + square_idx] = 1.
+    return features
+
+# (N, 768) float32 matrix of 0s and 1s.
+def fen_features(fens: Sequence[str]) -> np.ndarray:
+    return square_features(fen_squares(fens))
+
+# (N, 12) bitboards, column piece_index(piece_type, color). A compact form
+# to store positions in.
+def pack_boards(boards: Iterable[chess.Board]) -> np.ndarray:
+    rows = []
+    for b in boards:
+        for side in (b.occupied_co[chess.WHITE], b.occupied_co[chess.BLACK]):
+            rows.append([b.pawns & side, b.knights & side, b.bishops & side,
+                         b.rooks & side, b.queens & side, b.kings & side])
+    return np.array(rows, dtype=np.uint64).reshape(-1, 12)
+
+# pack_boards' bitboards as the same matrix fen_features gives.
+def unpack(packed: np.ndarray) -> np.ndarray:
+    as_bytes = packed.astype("<u8").view(np.uint8)
+    return np.unpackbits(as_bytes, axis=1, bitorder="little").astype(np.float32)
+
+def board_features(boards: Iterable[chess.Board]) -> np.ndarray:
+    return unpack(pack_boards(boards))
+
+# (mg sums, eg sums, phases) of a feature matrix, as float64.
+def scores(features: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    sums = (features @ weights).astype(np.float64)
+    return sums[:, 0], sums[:, 1], sums[:, 2] / 24.
+
+# The same floats as eval_piece_vals, as (evals, phases).
+def tapered(mg: np.ndarray, eg: np.ndarray, phases: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return mg * phases + eg * (1. - phases), phases
+
+def evaluate(features: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return tapered(*scores(features))
+
+def evaluate_fens(fens: Sequence[str]) -> tuple[np.ndarray, np.ndarray]:
+    batches = [evaluate(fen_features(fens[start:start + batch_rows]))
+               for start in range(0, len(fens), batch_rows)]
+    return concatenate(batches)
+
+def evaluate_boards(boards: Sequence[chess.Board]) -> tuple[np.ndarray, np.ndarray]:
+    batches = [evaluate(board_features(boards[start:start + batch_rows]))
+               for start in range(0, len(boards), batch_rows)]
+    return concatenate(batches)
+
+def concatenate(batches: list[tuple[np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray]:
+    if not batches:
+        return np.zeros(0), np.zeros(0)
+    return np.concatenate([evals for evals, _ in batches]), \
+        np.concatenate([phases for _, phases in batches])
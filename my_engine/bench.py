@@ -0,0 +1,185 @@
+import chess
+import json
+import time
+from typing import Any, Optional
+from my_engine import engine
+
+# A fixed spread of openings, middlegames and endgames, so runs on different
+# commits search the same trees.
+bench_fens = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r3k2r/ppp2ppp/2n1bn2/3qp3/3P4/2P1BN2/PP3PPP/RN1QKB1R w KQkq - 0 8",
+    "r2q1rk1/4b1pp/2p5/p1PpP3/3Qp3/8/PP3PPP/R1B2RK1 w - - 0 17",
+    "Bn1qbrkb/p2n1p1p/6p1/3p4/Q2P3P/4PN2/PP2KPP1/R1B4R b - - 0 14",
+    "r1bq1rk1/pp2nppp/2n1p3/3pP3/1b1P4/2NB1N2/PP3PPP/R1BQK2R w KQ - 3 9",
+    "2rq1rk1/pb1nbppp/1p2pn2/2pp4/2PP4/1PN1PN2/PB2BPPP/2RQ1RK1 w - - 2 11",
+    "7k/8/7p/1pb5/4PP2/3p2Q1/2q4P/5RKR w - - 0 41",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "8/8/4k3/3p4/3P4/4K3/5P2/8 w - - 0 50",
+    "6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1",
+]
+
+default_depth = 20000
+
+Record = dict[str, Any]
+
+def bench_position(fen: str, 
+                   depth: int, 
+                   ordering: engine.Ordering, 
+                   leaf_mode: engine.LeafMode,
+                   null_move: bool,
+                   late_move_reductions: bool) -> Record:
+    b = chess.Board(fen)
+    iteration_seconds : list[float] = []
+    start = time.monotonic()
+
+    def on_iteration(iteration: int,
+                     positions_explored: int,
+                     res: engine.SearchRes,
+                     pv: list[chess.Move]) -> None:
+        iteration_seconds.append(time.monotonic() - start)
+
+    res, _ = engine.go(b, depth, ordering, 
+                       on_iteration=on_iteration, 
+                       leaf_mode=leaf_mode,
+                       null_move=null_move,
+                       late_move_reductions=late_move_reductions)
+    seconds = time.monotonic() - start
+    return {"fen": fen,
+            "positions_explored": res.positions_explored,
+            "seconds": seconds,
+            "nps": res.positions_explored / seconds if seconds > 0 else 0.,
+            "best_move": engine.best_move_of_eval(res.sorted_moves).uci(),
+            "iteration_seconds": iteration_seconds}
+
+def run(depth: int, 
+        ordering: engine.Ordering, 
+        leaf_mode: engine.LeafMode,
+        null_move: bool,
+        late_move_reductions: bool) -> Record:
+    records = []
+    for fen in bench_fens:
+        record = bench_position(fen, depth, ordering, leaf_mode, null_move, late_move_reductions)
+        print(f"{record['positions_explored']:>9} positions {record['nps']:>9.0f} nps "
+              f"{record['best_move']:>6}  {fen}", flush=True)
+        records.append(record)
+    positions_explored = sum(record["positions_explored"] for record in records)
+    seconds = sum(record["seconds"] for record in records)
+    return {"depth": depth,
+            "ordering": ordering.value,
+            "leaf_mode": leaf_mode.value,
+            "null_move": null_move,
+            "late_move_reductions": late_move_reductions,
+            "positions_explored": positions_explored,
+            "seconds": seconds,
+            "nps": positions_explored / seconds,
+            "positions": records}
+
+def pct_change(new: float, old: float) -> float:
+    if old == 0:
+        return 0.
+    return 100. * (new - old) / old
+
+# (iteration, baseline seconds, run seconds) with the seconds to finish the
+# iteration summed over the positions, for each iteration that every position
+# finished in both runs. Baselines saved before iteration times were
+# recorded give none.
+def time_to_depth(run: Record, baseline: Record) -> list[tuple[int, float, float]]:
+    pairs = list(zip(run["positions"], baseline["positions"]))
+    if not pairs or any("iteration_seconds" not in old for _, old in pairs):
+        return []
+    iterations = min(min(len(new["iteration_seconds"]), len(old["iteration_seconds"]))
+                     for new, old in pairs)
+    return [(iteration + 1,
+             sum(old["iteration_seconds"][iteration] for _, old in pairs),
+             sum(new["iteration_seconds"][iteration] for new, _ in pairs))
+            for iteration in range(iterations)]
+
+# Returns the lines of the report, and whether nothing regressed past the
+# tolerances (fractions, e.g. 0.05 for 5%). Time to depth is judged on the
+# deepest iteration every position reached.
+def compare(run: Record, 
+            baseline: Record, 
+            nodes_tolerance: float, 
+            nps_tolerance: float,
+            ttd_tolerance: float) -> tuple[list[str], bool]:
+    lines = [f"{'positions explored':>32} {'nps':>28}  best move"]
+    for new, old in zip(run["positions"], baseline["positions"]):
+        if new["fen"] != old["fen"]:
+            raise ValueError(f"baseline was run on different positions: {old['fen']}")
+        agreement = "same" if new["best_move"] == old["best_move"] else \
+            f"{old['best_move']} -> {new['best_move']}"
+        lines.append(f"{old['positions_explored']:>10} -> {new['positions_explored']:<9}"
+                     f"{pct_change(new['positions_explored'], old['positions_explored']):>+7.1f}% "
+                     f"{old['nps']:>9.0f} -> {new['nps']:<8.0f}"
+                     f"{pct_change(new['nps'], old['nps']):>+7.1f}%  {agreement}")
+    agreeing = sum(new["best_move"] == old["best_move"]
+                   for new, old in zip(run["positions"], baseline["positions"]))
+
+    nodes_change = pct_change(run["positions_explored"], baseline["positions_explored"])
+    nps_change = pct_change(run["nps"], baseline["nps"])
+    lines.append(f"total positions: {baseline['positions_explored']} -> "
+                 f"{run['positions_explored']} ({nodes_change:+.1f}%)")
+    lines.append(f"total nps: {baseline['nps']:.0f} -> {run['nps']:.0f} ({nps_change:+.1f}%)")
+    lines.append(f"best move agreement: {agreeing}/{len(run['positions'])}")
+    ttd = time_to_depth(run, baseline)
+    for iteration, old_seconds, new_seconds in ttd:
+        lines.append(f"time to iteration {iteration}: {old_seconds:.3f}s -> {new_seconds:.3f}s "
+                     f"({pct_change(new_seconds, old_seconds):+.1f}%)")
+
+    ok = True
+    if nodes_change > nodes_tolerance * 100:
+        lines.append(f"REGRESSION: positions explored up {nodes_change:.1f}%, "
+                     f"tolerance {nodes_tolerance * 100:.1f}%")
+        ok = False
+    if -nps_change > nps_tolerance * 100:
+        lines.append(f"REGRESSION: nps down {-nps_change:.1f}%, "
+                     f"tolerance {nps_tolerance * 100:.1f}%")
+        ok = False
+    if ttd:
+        iteration, old_seconds, new_seconds = ttd[-1]
+        ttd_change = pct_change(new_seconds, old_seconds)
+        if ttd_change > ttd_tolerance * 100:
+            lines.append(f"REGRESSION: time to iteration {iteration} up {ttd_change:.1f}%, "
+                         f"tolerance {ttd_tolerance * 100:.1f}%")
+            ok = False
+    return lines, ok
+
+def main(depth: int,
+         ordering: engine.Ordering,
+         leaf_mode: engine.LeafMode,
+         null_move: bool,
+         late_move_reductions: bool,
+         save: Optional[str],
+         baseline: Optional[str],
+         nodes_tolerance: float,
+         nps_tolerance: float,
+         ttd_tolerance: float) -> bool:
+    baseline_run : Optional[Record] = None
+    if baseline is not None:
+        with open(baseline, "r") as f:
+            baseline_run = json.load(f)
+        assert baseline_run is not None
+        # always search at the baseline's settings, so the two are comparable
+        depth = baseline_run["depth"]
+        ordering = engine.Ordering(baseline_run["ordering"])
+        # older baselines predate leaf modes
+        leaf_mode = engine.LeafMode(baseline_run.get("leaf_mode", engine.LeafMode.EXTENSIONS.value))
+        null_move = baseline_run.get("null_move", False)
+        late_move_reductions = baseline_run.get("late_move_reductions", False)
+
+    bench_run = run(depth, ordering, leaf_mode, null_move, late_move_reductions)
+    print(f"total: {bench_run['positions_explored']} positions "
+          f"{bench_run['seconds']:.2f}s {bench_run['nps']:.0f} nps")
+    if save is not None:
+        with open(save, "w") as f:
+            json.dump(bench_run, f, indent=1)
+
+    if baseline_run is None:
+        return True
+    lines, ok = compare(bench_run, baseline_run, nodes_tolerance, nps_tolerance, ttd_tolerance)
+    for line in lines:
+        print(line)
+    return ok
@@ -0,0 +1,96 @@
+# Polyglot opening books: probing one from the UCI loop, and compiling one
+# from our opening move lists.
+import chess
+import chess.polyglot
+import csv
+import random
+import struct
+from collections import Counter
+from typing import Iterable, Iterator, Optional
+
+from my_engine import zobrist
+
+# books are opened (memory mapped) once and kept around between searches
+readers : dict[str, chess.polyglot.MemoryMappedReader] = {}
+
+def open_book(path: str) -> chess.polyglot.MemoryMappedReader:
+    if path not in readers:
+        readers[path] = chess.polyglot.open_reader(path)
+    return readers[path]
+
+def close_books() -> None:
+    for reader in readers.values():
+        reader.close()
+    readers.clear()
+
+# A book move for [b], picked at random in proportion to the weights, or None
+# once the game is [book_depth] plies in or the book has nothing legal.
+def probe(path: str,
+          b: chess.Board,
+          book_depth: int,
+          rng: Optional[random.Random] = None) -> Optional[chess.Move]:
+    if b.ply() >= book_depth:
+        return None
+    try:
+        return open_book(path).weighted_choice(b, random=rng).move
+    except IndexError:
+        return None
+
+# Polyglot encodes castling as the king taking its own rook, and promotions
+# as 1 (knight) to 4 (queen).
+def encode_move(b: chess.Board, move: chess.Move) -> int:
+    to_square = move.to_square
+    if b.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        to_square = chess.square(7 if b.is_kingside_castling(move) else 0, rank)
+    promotion = move.promotion - 1 if move.promotion else 0
+    return to_square | (move.from_square << 6) | (promotion << 12)
+
+# A line is a space separated list of moves (SAN or UCI) from the starting
+# position, or a FEN then a semicolon then the moves played from it.
+def parse_line(line: str) -> tuple[chess.Board, list[str]]:
+    if ";" in line:
+        fen, moves = line.split(";", 1)
+        return chess.Board(fen.strip()), moves.split()
+    return chess.Board(), line.split()
+
+# Lines from a text file, or from the "moves" column of a csv like the
+# kaggle openings.csv used by notebooks/gen_strong_openings.ipynb.
+def read_lines(path: str) -> Iterator[str]:
+    with open(path, "r") as f:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield row["moves"]
+        else:
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+
+# Counts how many lines play each move in each position, over the first
+# [max_ply] moves of each line.
+def count_moves(lines: Iterable[str], max_ply: int) -> Counter[tuple[int, int]]:
+    counts : Counter[tuple[int, int]] = Counter()
+    for line in lines:
+        b, moves = parse_line(line)
+        for san in moves[:max_ply]:
+            move = b.parse_san(san)
+            counts[(zobrist.board_key(b), encode_move(b, move))] += 1
+            b.push(move)
+    return counts
+
+def write_book(path: str, counts: Counter[tuple[int, int]]) -> None:
+    # weights are 16 bit, so big counts are scaled down, but never to 0
+    scale = max(max(counts.values(), default=1) / 0xffff, 1.)
+    entries = sorted(((key, move, max(int(count / scale), 1))
+                      for (key, move), count in counts.items()),
+                     key=lambda entry: (entry[0], -entry[2]))
+    with open(path, "wb") as f:
+        for key, move, weight in entries:
+            f.write(struct.pack(">QHHI", key, move, weight, 0))
+
+def compile_main(inputs: list[str], out: str, max_ply: int) -> None:
+    counts : Counter[tuple[int, int]] = Counter()
+    for path in inputs:
+        counts.update(count_moves(read_lines(path), max_ply))
+    write_book(out, counts)
+    print(f"wrote {len(counts)} entries to {out}")
@@ -1,64 +1,29 @@
 import chess
 from dataclasses import dataclass
-from typing import Optional, Tuple, Union, Literal
-from line_profiler import profile
+from typing import Callable, Optional, Sequence, Tuple, Union, Literal
+from my_engine.instrument import profile
 from enum import Enum
 
 from my_engine.search_order import SearchOrder
+from my_engine.telemetry import Stats, cutoff_buckets
 from my_engine.linear_reward import LinearReward
 from my_engine.random_order import RandomOrder
+from my_engine.killer_history import KillerHistory
 from my_engine.quit_early import QuitEarly
-from my_engine.eval_piece_vals import eval_piece_vals, diff as piece_vals_diff
+from my_engine.eval_piece_vals import eval_piece_vals, record_diff, diffs as piece_vals_diffs
+from my_engine.move_record import MoveRecord, legal_moves
+from my_engine.transposition import TranspositionTable, Bound
+from my_engine import zobrist
+from my_engine.time_manager import SearchClock, SearchAborted
+from my_engine.quiescence import quiesce
+from my_engine.tablebase import Tablebases
 
 worst_white_score, worst_black_score = -1_000_000_000, 1_000_000_000
 
-move_improvement : dict[chess.Move, float] = {}
+# matches the default of the UCI Hash option
+default_hash_mb = 16
 
-class Stats:
-    moves_at_depth: list[int]
-    opt_moves_at_depth: list[int]
-    explorations_at_depth: list[int]
-
-    #extensions and moves_post_extensions should be ints instead of length 1
-    #lists
-    extensions: list[int]
-    moves_post_extensions: list[int]
-    def __init__(self, initial_eval: float):
-        self.moves_at_depth = [0 for _ in range(400)]
-        self.opt_moves_at_depth = [0 for _ in range(400)]
-        self.explorations_at_depth = [0 for _ in range(400)]
-        self.extensions = [0]
-        self.moves_post_extensions = [0]
-        self.initial_eval = initial_eval
-
-    @staticmethod
-    def print_two_dec(l: list[float]) -> None:
-        print([f"{num:.2f}" for num in l])
-       
-    @staticmethod 
-    def safe_div(a: int, b: int) -> float:
-        if b == 0:
-            if a == 0:
-                return 0.
-            else:
-                return 9999999999.
-        return a/b
-    
-    def print(self) -> None:
-        avg_moves_at_depth = [Stats.safe_div(m,e) for m, e in zip(self.moves_at_depth, self.explorations_at_depth)] 
-        avg_opt_moves_at_depth = [Stats.safe_div(m,e) for m, e in zip(self.opt_moves_at_depth, self.explorations_at_depth)] 
-        print("avg moves at depth:")
-        Stats.print_two_dec(avg_moves_at_depth)
-        print("avg opt moves at depth")
-        Stats.print_two_dec(avg_opt_moves_at_depth)
-        print("explorations at depth")
-        print(self.explorations_at_depth)
-        print("extensions")
-        print(self.extensions)
-        print("moves post extensions")
-        print(self.moves_post_extensions)
-        print("initial eval")
-        print(self.initial_eval)
+move_improvement : dict[chess.Move, float] = {}
 
 class SearchEvals(Enum):
     # We have a list of moves and evals to return. This is the standard case.
@@ -87,7 +52,7 @@ EarlyExit = Union[Tuple[Literal[SearchEvals.LOSS], chess.Color],
 
 # we could make SUBMOVELIST have a list of (move, Eval), but then we'd be
 # holding references to every Eval we ecounter and consume a lot of memory
-Eval = Union[Tuple[Literal[SearchEvals.SUBMOVE_LIST], list[Tuple[chess.Move, float]]],
+Eval = Union[Tuple[Literal[SearchEvals.SUBMOVE_LIST], Sequence[Tuple[chess.Move, float]]],
              Tuple[Literal[SearchEvals.LEAF_EVAL], float],
              Tuple[Literal[SearchEvals.FORCED], chess.Move],
              EarlyExit]
@@ -132,28 +97,6 @@ def best_move_of_eval(eval: Eval) -> chess.Move:
         raise ValueError(eval)
     return best_move
 
-def compare_evals(a:Eval, b:Eval, color:chess.Color) -> int:
-    a_score = float_of_eval(a)
-    b_score = float_of_eval(b)
-    if a_score > b_score:
-        res = -1
-    elif a_score == b_score:
-        res = 0
-    else:
-        res = 1
-        
-    if color == chess.WHITE:
-        mult = 1
-    else:
-        mult = -1
-    return res * mult
-
-def print_eval(eval: Eval) -> str:
-    if eval[0] == SearchEvals.SUBMOVE_LIST:
-        return f"(submove: {float_of_eval(eval)}"
-    else:
-        return str(eval)
-
 @dataclass
 class SearchRes:
     sorted_moves : Eval
@@ -162,8 +105,74 @@ class SearchRes:
     positions_explored : int
     explored : Optional[list[Tuple[chess.Move, Eval]]]
 
-@dataclass 
+# Inside the search, scores are white relative ints in centipawns. Mates are
+# scored mate_score less the distance from the root to the mate, so a quicker
+# mate scores higher.
+mate_score = 1_000_000
+max_distance_from_root = 400
+# scores beyond mate_bound (either way) are mates
+mate_bound = mate_score - max_distance_from_root
+infinite_score = mate_score + 1
+# what a side whose position QuitEarly judged hopeless is taken to have lost
+hopeless_score = 100_000
+# what a tablebase win is worth, less the distance from the root so nearer
+# wins are preferred. Between hopeless_score and the mate scores.
+tablebase_win_score = 500_000
+# scores from tablebase_bound to tablebase_win_score (either way) are
+# tablebase wins
+tablebase_bound = tablebase_win_score - max_distance_from_root
+
+def mated_score(color: chess.Color, distance_from_root: int) -> int:
+    if color == chess.WHITE:
+        return -mate_score + distance_from_root
+    return mate_score - distance_from_root
+
+# How many plies from the root the mate in [score] is, if it is one.
+def mate_distance(score: float) -> Optional[int]:
+    if abs(score) < mate_bound:
+        return None
+    return int(mate_score - abs(score))
+
+# How many plies from the root the tablebase position won in [score] is, if
+# it is one.
+def tablebase_distance(score: float) -> Optional[int]:
+    if not tablebase_bound <= abs(score) <= tablebase_win_score:
+        return None
+    return int(tablebase_win_score - abs(score))
+
+# [wdl] is a tablebase result for [turn], the side to move.
+def tablebase_score(wdl: int, turn: chess.Color, distance_from_root: int) -> int:
+    # wins and losses the fifty move rule takes away are draws
+    if abs(wdl) < 2:
+        return 0
+    score = tablebase_win_score - distance_from_root
+    if (wdl > 0) != (turn == chess.WHITE):
+        score = -score
+    return score
+
+# The transposition table holds mate scores and tablebase wins as distances
+# from the position they were stored for, since the same position can be
+# reached at different distances from the root.
+def distance_sign(score: int) -> int:
+    if abs(score) >= mate_bound or tablebase_bound <= abs(score) <= tablebase_win_score:
+        return 1 if score > 0 else -1
+    return 0
+
+def score_to_tt(score: int, distance_from_root: int) -> int:
+    return score + distance_sign(score) * distance_from_root
+
+def score_from_tt(score: int, distance_from_root: int) -> int:
+    return score - distance_sign(score) * distance_from_root
+
+# The search keeps one CalcParams per distance from the root, allocated once
+# per search in a CalcParamsStack. A node reads its own entry and fills in
+# its child's before recursing, so nothing is allocated per node.
 class CalcParams:
+    __slots__ = ("move_depth", "ply_depth", "check_big_extensions", 
+                 "check_small_extensions", "capture_small_extensions", 
+                 "white_can_get", "black_can_get", "distance_from_root", 
+                 "current_eval", "current_game_phase", "zobrist_key", 
+                 "quiescence", "null_move", "late_move_reductions", "extended")
     move_depth: int
     # if we run out of move_depth to explore, ply_depth says how many additional
     # plies to explore
@@ -171,11 +180,43 @@ class CalcParams:
     check_big_extensions : int # continue searching with more depth after check
     check_small_extensions : int # continue searching with same depth after check
     capture_small_extensions : int
-    white_can_get: Eval
-    black_can_get: Eval
+    # the alpha/beta window, as scores
+    white_can_get: int
+    black_can_get: int
     distance_from_root: int
     current_eval: float
     current_game_phase: float
+    zobrist_key: int
+    # leaves are scored by quiesce rather than by the static eval
+    quiescence: bool
+    # whether to try null move pruning, and to give moves ordered late less
+    # budget
+    null_move: bool
+    late_move_reductions: bool
+    # whether a capture or check extension was taken on the way here
+    extended: bool
+
+    def __init__(self, distance_from_root: int):
+        self.move_depth = 0
+        self.ply_depth = 0
+        self.check_big_extensions = 0
+        self.check_small_extensions = 0
+        self.capture_small_extensions = 0
+        self.white_can_get = -infinite_score
+        self.black_can_get = infinite_score
+        self.distance_from_root = distance_from_root
+        self.current_eval = 0.
+        self.current_game_phase = 0.
+        self.zobrist_key = 0
+        self.quiescence = False
+        self.null_move = False
+        self.late_move_reductions = False
+        self.extended = False
+
+CalcParamsStack = list[CalcParams]
+
+def calc_params_stack() -> CalcParamsStack:
+    return [CalcParams(distance) for distance in range(max_distance_from_root + 1)]
 
 
 def better_eval(a: Optional[float], b: Optional[float], color: chess.Color) -> int:
@@ -189,42 +230,55 @@ def better_eval(a: Optional[float], b: Optional[float], color: chess.Color) -> i
     else:
         return 1
 
-# We should wrap the move type, so we can store capture/check status and make
-# them quick to query, so code can handle moves that are captures and checks
 class Interestingness(Enum):
     CAPTURE = "CAPTURE"
     CHECK = "CHECK"
     UNINTERESTING = "UNINTERESTING"
 
+# [b] is the position [record]'s move is played from.
+def move_interestingness(b: chess.Board, record: MoveRecord) -> Interestingness:
+    if record.captured:
+        return Interestingness.CAPTURE
+    if record.gives_check(b):
+        return Interestingness.CHECK
+    return Interestingness.UNINTERESTING
+
+# [moves] are the position's legal moves.
 @profile
 def early_ret(b:chess.Board, 
+              moves:list[MoveRecord],
               current_eval:float, 
               distance_from_root:int, 
-              quit_early:QuitEarly, 
-              positions_explored:int) -> Optional[SearchRes]:
-    # does [b.turn] flip if there's checkmate? if not, this needs to be fixed
-    if b.is_checkmate():
-        return SearchRes((SearchEvals.LOSS, b.turn), positions_explored, None)
-    if b.is_stalemate():
-        return SearchRes((SearchEvals.DRAW, None), positions_explored, None)
+              quit_early:QuitEarly) -> Optional[int]:
+    if len(moves) == 0:
+        if b.is_check():
+            return mated_score(b.turn, distance_from_root)
+        return 0
     if distance_from_root >= 4:
+        # should_quit_early says the side to move has fallen too far behind
         if quit_early.should_quit_early(current_eval, b.turn):
-            return SearchRes((SearchEvals.LOSS, not(b.turn)), positions_explored, None)
+            return -hopeless_score if b.turn == chess.WHITE else hopeless_score
 
     return None
     
-# returns eval and positions_explored
+# returns the score of the position after [move], searched with the
+# white_can_get/black_can_get window
 @profile
 def explore_move(b: chess.Board, 
-                 move: chess.Move, 
-                 prev_calc_params: CalcParams,
+                 record: MoveRecord, 
+                 stack: CalcParamsStack,
+                 distance_from_root: int,
                  sibling_move_count: int,
+                 white_can_get: int,
+                 black_can_get: int,
                  quit_early: QuitEarly,
                  search_order: SearchOrder,
-                 repeat_moves: dict[str, SearchRes],
-                 moves_from_root : list[chess.Move],
+                 tt: TranspositionTable,
+                 tablebases: Optional[Tablebases],
+                 clock: SearchClock,
                  stats:Stats,
-                 sequence_to_track: Optional[list[chess.Move]]) -> Tuple[Eval, int]:
+                 sequence_to_track: Optional[list[chess.Move]]) -> int:
+    prev_calc_params = stack[distance_from_root]
     next_depth = prev_calc_params.move_depth // sibling_move_count
     next_ply_depth = prev_calc_params.ply_depth
     next_check_big_extensions = prev_calc_params.check_big_extensions
@@ -234,7 +288,7 @@ def explore_move(b: chess.Board,
     is_first_extension = False
     is_extension = False
 
-    eval_diff, game_phase_diff = piece_vals_diff(b, move, prev_calc_params.current_game_phase)
+    eval_diff, game_phase_diff = record_diff(b.turn, record, prev_calc_params.current_game_phase)
     next_eval, next_game_phase = \
         prev_calc_params.current_eval + eval_diff, \
             prev_calc_params.current_game_phase + game_phase_diff
@@ -245,63 +299,117 @@ def explore_move(b: chess.Board,
     # move quickly down a different branch.
     # Until we've set it up to search like this, we just have to limit capture
     # and check extension depth.
-    interestingness = Interestingness.UNINTERESTING
-    if b.is_capture(move):
-        interestingness = Interestingness.CAPTURE
-    b.push(move)
-    if interestingness == Interestingness.UNINTERESTING and b.is_check():
-        interestingness = Interestingness.CHECK
-        
+    next_zobrist_key = zobrist.key_after(b, prev_calc_params.zobrist_key, record.move)
+    if next_depth <= 0 and next_ply_depth <= 0:
+        interestingness = move_interestingness(b, record)
+    b.push(record.move)
+
     if next_depth <= 0 and next_ply_depth <= 0:
         if interestingness == Interestingness.CAPTURE and next_capture_small_extensions > 0:
             next_capture_small_extensions -= 1
             next_depth = prev_calc_params.move_depth
-            #print(move, prev_calc_params.distance_from_root, next_depth)
+            #print(record.move, prev_calc_params.distance_from_root, next_depth)
             is_leaf = False
+            is_extension = True
         elif interestingness == Interestingness.CHECK and next_check_small_extensions > 0:
             next_check_small_extensions -= 1
             if next_check_big_extensions > 0:
                 next_check_big_extensions -= 1
                 next_ply_depth += 1
             is_leaf = False
+            is_extension = True
         else:
             is_leaf = True
+        is_first_extension = is_extension and not prev_calc_params.extended
     else:
         if next_ply_depth > 0:
             next_ply_depth -= 1
         is_leaf = False
             
-    if is_leaf:
-            res : Tuple[Eval, int] = ((SearchEvals.LEAF_EVAL, next_eval), 1)
+    if is_leaf and prev_calc_params.quiescence:
+        score = quiesce(b, next_eval, next_game_phase, white_can_get, black_can_get, clock)
+    elif is_leaf:
+        clock.positions_explored += 1
+        score = round(next_eval)
     else:
-        params = CalcParams(next_depth,
-                            next_ply_depth,
-                            next_check_big_extensions,
-                            next_check_small_extensions,
-                            next_capture_small_extensions,
-                            prev_calc_params.white_can_get, 
-                            prev_calc_params.black_can_get, 
-                            prev_calc_params.distance_from_root+1,
-                            next_eval,
-                            next_game_phase)
-        moves_from_root.append(move)
-        search_res = calc_best_move(b, 
-                                    params,
-                                    quit_early,
-                                    search_order,
-                                    repeat_moves,
-                                    moves_from_root,
-                                    stats,
-                                    sequence_to_track)
-        moves_from_root.pop()
+        params = stack[distance_from_root + 1]
+        params.move_depth = next_depth
+        params.ply_depth = next_ply_depth
+        params.check_big_extensions = next_check_big_extensions
+        params.check_small_extensions = next_check_small_extensions
+        params.capture_small_extensions = next_capture_small_extensions
+        params.white_can_get = white_can_get
+        params.black_can_get = black_can_get
+        params.current_eval = next_eval
+        params.current_game_phase = next_game_phase
+        params.zobrist_key = next_zobrist_key
+        params.quiescence = prev_calc_params.quiescence
+        params.null_move = prev_calc_params.null_move
+        params.late_move_reductions = prev_calc_params.late_move_reductions
+        params.extended = prev_calc_params.extended or is_extension
+        positions_before = clock.positions_explored
+        score = calc_best_move(b, 
+                               stack,
+                               distance_from_root + 1,
+                               quit_early,
+                               search_order,
+                               tt,
+                               tablebases,
+                               clock,
+                               stats,
+                               sequence_to_track)
 
         if is_extension:
-            stats.extensions[0] += 1
+            stats.extensions += 1
         if is_first_extension:
-            stats.moves_post_extensions[0] += search_res.positions_explored
-        res = (search_res.sorted_moves, search_res.positions_explored)
+            stats.moves_post_extensions += clock.positions_explored - positions_before
+    b.pop()
+    return score
+
+# Returns the score of the position after the side to move passes, searched
+# with [move_depth] and the white_can_get/black_can_get window.
+@profile
+def null_move_score(b: chess.Board,
+                    stack: CalcParamsStack,
+                    distance_from_root: int,
+                    move_depth: int,
+                    white_can_get: int,
+                    black_can_get: int,
+                    quit_early: QuitEarly,
+                    search_order: SearchOrder,
+                    tt: TranspositionTable,
+                    tablebases: Optional[Tablebases],
+                    clock: SearchClock,
+                    stats: Stats) -> int:
+    prev_calc_params = stack[distance_from_root]
+    params = stack[distance_from_root + 1]
+    params.move_depth = move_depth
+    params.ply_depth = 0
+    params.check_big_extensions = prev_calc_params.check_big_extensions
+    params.check_small_extensions = prev_calc_params.check_small_extensions
+    params.capture_small_extensions = prev_calc_params.capture_small_extensions
+    params.white_can_get = white_can_get
+    params.black_can_get = black_can_get
+    params.current_eval = prev_calc_params.current_eval
+    params.current_game_phase = prev_calc_params.current_game_phase
+    params.zobrist_key = zobrist.null_key_after(b, prev_calc_params.zobrist_key)
+    params.quiescence = prev_calc_params.quiescence
+    params.null_move = prev_calc_params.null_move
+    params.late_move_reductions = prev_calc_params.late_move_reductions
+    params.extended = prev_calc_params.extended
+    b.push(chess.Move.null())
+    score = calc_best_move(b, 
+                           stack, 
+                           distance_from_root + 1, 
+                           quit_early, 
+                           search_order, 
+                           tt, 
+                           tablebases,
+                           clock, 
+                           stats, 
+                           None)
     b.pop()
-    return res
+    return score
 
 def comp_lists(a : list[str], b : list[str]) -> bool:
     if len(a) != len(b):
@@ -309,162 +417,518 @@ def comp_lists(a : list[str], b : list[str]) -> bool:
     
     return all([a_ == b_ for a_, b_ in zip(a, b)])
 
+# Searches the position and returns its score. The score is exact if it falls
+# inside the white_can_get/black_can_get window; otherwise it is a bound on
+# the exact score, on the same side of the window.
+# At the root, [root_moves] is filled with each searched move and its score.
 @profile
 def calc_best_move(b: chess.Board,
-                   params: CalcParams,
+                   stack: CalcParamsStack,
+                   distance_from_root: int,
                    quit_early: QuitEarly,
                    search_order: SearchOrder,
-                   repeat_moves: dict[str, SearchRes],
-                   moves_from_root: list[chess.Move],
+                   tt: TranspositionTable,
+                   tablebases: Optional[Tablebases],
+                   clock: SearchClock,
                    stats: Stats,
-                   sequence_to_track : Optional[list[chess.Move]]) -> SearchRes:
-    positions_explored = 0
-    pos_rep : Optional[str] = None
-    # this repeat method is currently bad so we disable. consider a capture
-    # where black moves a piece to an open square then white captures. that
-    # appears as the same position as white moving first to the open square and
-    # black capturing.
-    if False and params.distance_from_root >= 3 and params.distance_from_root <= 6:
-        # TODO:
-        # We miss a decent number of repeats with this cheaper check. for
-        # [7k/8/7p/1pb5/4PP2/3p2Q1/2q4P/5RKR w - - 0 41] at 30,000, 2700 repeats
-        # detected instead of the full 4700.
-        # We can get fully accurate cheap detection by looking at the condensed
-        # moves of each piece (if a piece moves twice, condense into one).
-        move_reps = [move.uci() for move in moves_from_root]
-        pos_rep = "".join(sorted(move_reps))
-        if pos_rep in repeat_moves:
-            search_res = repeat_moves[pos_rep]
-            return SearchRes(search_res.sorted_moves, positions_explored, None)
-    
-    quit_early_res = early_ret(b, 
-                               params.current_eval, 
-                               params.distance_from_root, 
-                               quit_early, 
-                               positions_explored)
-    if quit_early_res:
-        # don't need to hash these cases
-        return quit_early_res
+                   sequence_to_track : Optional[list[chess.Move]],
+                   root_moves : Optional[list[Tuple[chess.Move, int]]] = None,
+                   root_filter : Optional[list[chess.Move]] = None,
+                   root_hint : Optional[chess.Move] = None) -> int:
+    clock.check()
+    params = stack[distance_from_root]
+    white_can_get = params.white_can_get
+    black_can_get = params.black_can_get
 
-    explored_moves : list[Tuple[chess.Move, Eval]] = []
-    ordered_moves = search_order.order_moves(b)
-    stats.moves_at_depth[params.distance_from_root] += len(ordered_moves)
-    stats.explorations_at_depth[params.distance_from_root] += 1
+    if tablebases is not None and root_moves is None and tablebases.can_probe(b):
+        wdl = tablebases.probe_wdl(b, params.zobrist_key)
+        if wdl is not None:
+            stats.tablebase_hits += 1
+            clock.positions_explored += 1
+            return tablebase_score(wdl, b.turn, distance_from_root)
+
+    tt_move : Optional[chess.Move] = None
+    stats.tt_probes += 1
+    tt_entry = tt.probe(params.zobrist_key)
+    if tt_entry is not None:
+        stats.tt_hits += 1
+        tt_score, tt_move_depth, tt_ply_depth, tt_bound, tt_move = tt_entry
+        if root_moves is None \
+            and tt_move_depth >= params.move_depth \
+            and tt_ply_depth >= params.ply_depth:
+            tt_score = score_from_tt(tt_score, distance_from_root)
+            if tt_bound == Bound.EXACT \
+                or (tt_bound == Bound.LOWER and tt_score >= black_can_get) \
+                or (tt_bound == Bound.UPPER and tt_score <= white_can_get):
+                stats.tt_cutoffs += 1
+                return tt_score
+    if tt_move is None:
+        tt_move = root_hint
     
-    if params.distance_from_root == 0 and len(ordered_moves) == 1:
-        return SearchRes((SearchEvals.FORCED, ordered_moves[0]), positions_explored, None)
+    moves = legal_moves(b)
+    if root_filter is not None:
+        moves = [record for record in moves if record.move in root_filter]
+    early_score = early_ret(b, 
+                            moves,
+                            params.current_eval, 
+                            distance_from_root, 
+                            quit_early)
+    if early_score is not None:
+        # don't need to hash these cases
+        return early_score
+
+    white_to_move = b.turn == chess.WHITE
+    in_check = None
+    # Null move pruning: if the side to move is past the window even after
+    # passing, it will be with a move too. Only tried on null windows (away
+    # from the principal variation), never twice in a row, and only with
+    # pieces besides pawns on the board, since in pawn endings having to move
+    # is often what loses (zugzwang).
+    null_move_depth = params.move_depth // (len(moves) * null_move_reduction)
+    if params.null_move and root_moves is None \
+        and null_move_depth > 0 \
+        and black_can_get - white_can_get == 1 \
+        and params.current_game_phase >= null_move_min_game_phase \
+        and b.move_stack[-1] \
+        and b.occupied_co[b.turn] & ~(b.pawns | b.kings) \
+        and (params.current_eval >= black_can_get if white_to_move
+             else params.current_eval <= white_can_get):
+        in_check = b.is_check()
+        if not in_check:
+            stats.null_moves += 1
+            null_score = null_move_score(b, 
+                                         stack, 
+                                         distance_from_root, 
+                                         null_move_depth,
+                                         white_can_get,
+                                         black_can_get,
+                                         quit_early, 
+                                         search_order, 
+                                         tt, 
+                                         tablebases,
+                                         clock, 
+                                         stats)
+            # a mate found after passing isn't one the side to move is
+            # forced into, so only the bound is returned
+            if white_to_move and null_score >= black_can_get:
+                stats.null_move_cutoffs += 1
+                return black_can_get
+            if not white_to_move and null_score <= white_can_get:
+                stats.null_move_cutoffs += 1
+                return white_can_get
+
+    ordered_moves = search_order.order_moves(b, moves, distance_from_root)
+    if tt_move is not None:
+        for idx, record in enumerate(ordered_moves):
+            if record.move == tt_move:
+                ordered_moves.insert(0, ordered_moves.pop(idx))
+                break
+    stats.moves_at_depth[distance_from_root] += len(ordered_moves)
+    stats.explorations_at_depth[distance_from_root] += 1
     
-    early_break = None
-    white_can_get = params.white_can_get
-    black_can_get = params.black_can_get
     if sequence_to_track:
         print(f"move depth: {params.move_depth}")
         print(f"available moves: {len(ordered_moves)}")
     if len(ordered_moves) == 0:
         raise ValueError(f"no moves {b.fen()}")
-    for idx, move in enumerate(ordered_moves):
-        if sequence_to_track is not None and len(sequence_to_track) > 0 and move == sequence_to_track[0]:
-            next_sequence_to_track = sequence_to_track[1:]
-            print(f"exploring {move}", flush=True)
+
+    if params.late_move_reductions and in_check is None:
+        in_check = b.is_check()
+    best_score = -infinite_score if white_to_move else infinite_score
+    best_idx = 0
+    early_break = None
+    explored_scores : list[int] = []
+
+    # When the budget doesn't reach past this node's children, most of them
+    # are leaves. Their evals are computed in one pass and only the captures
+    # and checks that earn an extension go through explore_move. Leaves that
+    # get a quiescence search all go through explore_move.
+    frontier_diffs = None
+    if params.ply_depth <= 0 and params.move_depth // len(ordered_moves) <= 0 \
+        and not params.quiescence and sequence_to_track is None:
+        frontier_diffs = piece_vals_diffs(b.turn, ordered_moves, params.current_game_phase)
+    for idx, record in enumerate(ordered_moves):
+        move = record.move
+        score = None
+        if frontier_diffs is not None:
+            eval_diff, _ = frontier_diffs[idx]
+            if record.captured:
+                is_leaf = params.capture_small_extensions <= 0
+            else:
+                is_leaf = params.check_small_extensions <= 0 or not record.gives_check(b)
+            if is_leaf:
+                clock.positions_explored += 1
+                score = round(params.current_eval + eval_diff)
+
+        if score is None:
+            if sequence_to_track is not None and len(sequence_to_track) > 0 and move == sequence_to_track[0]:
+                next_sequence_to_track = sequence_to_track[1:]
+                print(f"exploring {move}", flush=True)
+            else:
+                next_sequence_to_track = None
+            # principal variation search: after the first move, we only
+            # need to know whether a move beats the best so far, which a
+            # null window around it answers cheaply. Only the moves that do
+            # are searched again with the full window.
+            if idx == 0:
+                scout_white_can_get, scout_black_can_get = white_can_get, black_can_get
+            elif white_to_move:
+                scout_white_can_get, scout_black_can_get = white_can_get, white_can_get + 1
+            else:
+                scout_white_can_get, scout_black_can_get = black_can_get - 1, black_can_get
+            # late move reductions: quiet moves ordered late are searched with
+            # a fraction of their share of the budget, and again with all of
+            # it if they turn out to beat the best move so far
+            reduced = params.late_move_reductions \
+                and idx >= late_move_first \
+                and not in_check \
+                and not record.captured \
+                and not record.promotion \
+                and not record.gives_check(b)
+            score = explore_move(b, 
+                                 record, 
+                                 stack,
+                                 distance_from_root,
+                                 len(ordered_moves) * (late_move_reduction if reduced else 1), 
+                                 scout_white_can_get,
+                                 scout_black_can_get,
+                                 quit_early, 
+                                 search_order, 
+                                 tt, 
+                                 tablebases,
+                                 clock,
+                                 stats,
+                                 next_sequence_to_track)
+            if reduced:
+                stats.reductions += 1
+                if (score > white_can_get) if white_to_move else (score < black_can_get):
+                    stats.reduction_re_searches += 1
+                    score = explore_move(b, 
+                                         record, 
+                                         stack,
+                                         distance_from_root,
+                                         len(ordered_moves), 
+                                         scout_white_can_get,
+                                         scout_black_can_get,
+                                         quit_early, 
+                                         search_order, 
+                                         tt, 
+                                         tablebases,
+                                         clock,
+                                         stats,
+                                         next_sequence_to_track)
+            if idx > 0:
+                stats.scouts += 1
+                if white_can_get < score < black_can_get:
+                    stats.scout_re_searches += 1
+                    score = explore_move(b, 
+                                         record, 
+                                         stack,
+                                         distance_from_root,
+                                         len(ordered_moves), 
+                                         white_can_get,
+                                         black_can_get,
+                                         quit_early, 
+                                         search_order, 
+                                         tt, 
+                                         tablebases,
+                                         clock,
+                                         stats,
+                                         next_sequence_to_track)
+        if root_moves is not None:
+            root_moves.append((move, score))
+        explored_scores.append(score)
+        if white_to_move:
+            if score > best_score:
+                best_score, best_idx = score, idx
+                if score > white_can_get:
+                    white_can_get = score
         else:
-            next_sequence_to_track = None
-        calc_params = CalcParams(params.move_depth, 
-                                 params.ply_depth,
-                                 params.check_big_extensions,
-                                 params.check_small_extensions,
-                                 params.capture_small_extensions,
-                                 white_can_get, 
-                                 black_can_get, 
-                                 params.distance_from_root, 
-                                 params.current_eval,
-                                 params.current_game_phase)
-        next_eval, additional_positions_explored = \
-            explore_move(b, 
-                         move, 
-                         calc_params, 
-                         len(ordered_moves), 
-                         quit_early, 
-                         search_order, 
-                         repeat_moves, 
-                         moves_from_root,
-                         stats,
-                         next_sequence_to_track)
-        positions_explored += additional_positions_explored
-        explored_moves.append((move, next_eval))
-        og_w, og_b = white_can_get, black_can_get
-        if b.turn == chess.WHITE and \
-            compare_evals(next_eval, white_can_get, chess.WHITE) < 0:
-            white_can_get = next_eval
-        elif b.turn == chess.BLACK and \
-            compare_evals(next_eval, black_can_get, chess.BLACK) < 0:
-            black_can_get = next_eval
-        if compare_evals(white_can_get, black_can_get, chess.WHITE) < 0:
+            if score < best_score:
+                best_score, best_idx = score, idx
+                if score < black_can_get:
+                    black_can_get = score
+        if white_can_get >= black_can_get:
             early_break = idx + 1
             break
 
+    explored_count = early_break if early_break else len(ordered_moves)
+    stats.opt_moves_at_depth[distance_from_root] += explored_count
     if early_break:
-        stats.opt_moves_at_depth[params.distance_from_root] += early_break
+        stats.cutoffs[distance_from_root * cutoff_buckets + min(early_break - 1, cutoff_buckets - 1)] += 1
+    search_order.update_priors(b, ordered_moves, explored_count, best_idx, 
+                               distance_from_root, params.move_depth, explored_scores)
+
+    # hopeless scores only mean something next to this search's root eval,
+    # and the table can outlive the search (see GameSession), so they're not
+    # stored
+    if abs(best_score) == hopeless_score:
+        return best_score
+    if best_score >= params.black_can_get:
+        bound = Bound.LOWER
+    elif best_score <= params.white_can_get:
+        bound = Bound.UPPER
     else:
-        stats.opt_moves_at_depth[params.distance_from_root] += len(ordered_moves)
-            
-    if len(explored_moves) == 0:
+        bound = Bound.EXACT
+    tt.store(params.zobrist_key, score_to_tt(best_score, distance_from_root), 
+             params.move_depth, params.ply_depth, bound, ordered_moves[best_idx].move)
+    return best_score
+
+# Searches the root with calc_best_move, and wraps the result up as a
+# SearchRes. If there is a [root_filter], only the moves in it are searched.
+# [root_hint] is searched first when the table has no move for the root.
+def search_root(b: chess.Board,
+                stack: CalcParamsStack,
+                quit_early: QuitEarly,
+                search_order: SearchOrder,
+                tt: TranspositionTable,
+                tablebases: Optional[Tablebases],
+                clock: SearchClock,
+                stats: Stats,
+                sequence_to_track : Optional[list[chess.Move]],
+                root_filter : Optional[list[chess.Move]] = None,
+                root_hint : Optional[chess.Move] = None,
+                root_moves : Optional[list[Tuple[chess.Move, int]]] = None) -> SearchRes:
+    positions_before = clock.positions_explored
+    legal_moves = list(b.legal_moves)
+    if root_filter is not None:
+        legal_moves = [move for move in legal_moves if move in root_filter]
+    if len(legal_moves) == 0:
         raise ValueError(b)
-    else:
+    if len(legal_moves) == 1:
+        return SearchRes((SearchEvals.FORCED, legal_moves[0]), 0, None)
+
+    if root_moves is None:
+        root_moves = []
+    calc_best_move(b, stack, 0, quit_early, search_order, tt, tablebases, clock, stats, 
+                   sequence_to_track, root_moves, root_filter, root_hint)
+    reverse = b.turn == chess.WHITE
+    sorted_root_moves = sorted(root_moves, key=lambda x: x[1], reverse=reverse)
+    explored : list[Tuple[chess.Move, Eval]] = \
+        [(move, (SearchEvals.LEAF_EVAL, score)) for move, score in sorted_root_moves]
+    return SearchRes((SearchEvals.SUBMOVE_LIST, sorted_root_moves),
+                     clock.positions_explored - positions_before,
+                     explored)
+
+# What to play when the search was stopped before its first iteration
+# finished: the best of the root moves it got through, or failing that the
+# first move in the search order.
+def unfinished_root_res(b: chess.Board,
+                        root_moves: list[Tuple[chess.Move, int]],
+                        search_order: SearchOrder,
+                        root_filter: Optional[list[chess.Move]],
+                        root_hint: Optional[chess.Move],
+                        initial_eval: float) -> SearchRes:
+    if root_moves:
         reverse = b.turn == chess.WHITE
-        sorted_explored_moves = sorted(explored_moves, key=lambda x: float_of_eval(x[1]), reverse=reverse)
-        search_order.update_priors([x[0] for x in sorted_explored_moves])
-        if early_break is None:
-            sorted_moves_evalled = [(x[0], float_of_eval(x[1])) for x in sorted_explored_moves]
-            sorted_moves : Eval = (SearchEvals.SUBMOVE_LIST, sorted_moves_evalled)
-        else:
-            sorted_moves = (SearchEvals.ALPHA_BETA_CROSS, b.turn)
-        search_res = SearchRes(sorted_moves, positions_explored, sorted_explored_moves)
-        if pos_rep:
-            repeat_moves[pos_rep] = search_res
-
-        return search_res
-    
-def go(b: chess.Board, move_depth: int, linear: bool = True) -> tuple[SearchRes, Stats]:
-    if linear:
-        search_order : SearchOrder = LinearReward()
+        sorted_root_moves = sorted(root_moves, key=lambda x: x[1], reverse=reverse)
     else:
-        search_order = RandomOrder()
-    
+        moves = legal_moves(b)
+        if root_filter is not None:
+            moves = [record for record in moves if record.move in root_filter]
+        ordered_moves = [record.move for record in search_order.order_moves(b, moves, 0)]
+        move = root_hint if root_hint in ordered_moves else ordered_moves[0]
+        sorted_root_moves = [(move, round(initial_eval))]
+    return SearchRes((SearchEvals.SUBMOVE_LIST, sorted_root_moves), 0, None)
+
+# Follows best moves through the transposition table, starting with [move]
+# from the root.
+def principal_variation(b: chess.Board, 
+                        tt: TranspositionTable, 
+                        move: chess.Move,
+                        max_length: int = 30) -> list[chess.Move]:
+    pv = [move]
+    key = zobrist.key_after(b, zobrist.board_key(b), move)
+    b.push(move)
+    seen_keys = {key}
+    while len(pv) < max_length:
+        entry = tt.probe(key)
+        if entry is None or entry[3] != Bound.EXACT or entry[4] is None \
+            or not b.is_legal(entry[4]):
+            break
+        next_move = entry[4]
+        key = zobrist.key_after(b, key, next_move)
+        if key in seen_keys:
+            break
+        seen_keys.add(key)
+        b.push(next_move)
+        pv.append(next_move)
+    for _ in pv:
+        b.pop()
+    return pv
+
+# Called after each finished iteration with the iteration number, the
+# positions explored so far by all iterations, the iteration's result and its
+# principal variation.
+OnIteration = Callable[[int, int, SearchRes, list[chess.Move]], None]
+
+class Ordering(Enum):
+    RANDOM = "RANDOM"
+    LINEAR = "LINEAR"
+    KILLER_HISTORY = "KILLER_HISTORY"
+
+def make_search_order(ordering: Ordering) -> SearchOrder:
+    if ordering == Ordering.LINEAR:
+        return LinearReward()
+    if ordering == Ordering.KILLER_HISTORY:
+        return KillerHistory(max_distance_from_root)
+    return RandomOrder()
+
+class LeafMode(Enum):
+    # captures and checks at the end of the budget are searched on, with the
+    # parent's budget, a limited number of times along a line
+    EXTENSIONS = "EXTENSIONS"
+    # the end of the budget is scored by a captures only quiescence search
+    QUIESCENCE = "QUIESCENCE"
+
+# a null move search gets the budget of a child divided by this
+null_move_reduction = 8
+# below this game phase (see eval_piece_vals.game_phase) positions are too
+# close to pawn endings for null moves
+null_move_min_game_phase = 0.25
+# moves from this index on in the search order may be reduced, to the budget
+# of a child divided by late_move_reduction
+late_move_first = 3
+late_move_reduction = 4
+
+# half the width of the first aspiration window, and how much it widens by
+# each time the score falls outside it
+aspiration_delta = 50
+aspiration_growth = 4
+
+# iterative deepening starts at this move_depth and multiplies it by
+# [iteration_growth] until reaching the requested move_depth
+first_iteration_depth = 1000
+iteration_growth = 3
+
+def go(b: chess.Board, 
+       move_depth: int, 
+       ordering: Ordering = Ordering.LINEAR, 
+       tt: Optional[TranspositionTable] = None,
+       clock: Optional[SearchClock] = None,
+       on_iteration: Optional[OnIteration] = None,
+       first_depth: int = first_iteration_depth,
+       leaf_mode: LeafMode = LeafMode.EXTENSIONS,
+       null_move: bool = False,
+       late_move_reductions: bool = False,
+       tablebases: Optional[Tablebases] = None,
+       search_order: Optional[SearchOrder] = None,
+       expected_move: Optional[chess.Move] = None) -> tuple[SearchRes, Stats]:
+    # a [search_order] passed in keeps its priors from earlier searches, and
+    # [ordering] is ignored
+    if search_order is None:
+        search_order = make_search_order(ordering)
+    if tt is None:
+        tt = TranspositionTable(default_hash_mb)
+    if clock is None:
+        clock = SearchClock()
 
-    depth_from_root = 0
-    repeat_moves : dict[str, SearchRes] = {}
     ply_depth = 0
     check_big_extensions = 0
-    check_small_extensions = 1
-    capture_small_extensions = 2
-    #repeat_moves_pre_search : dict[str, SearchRes] = {}
-    #params_pre_search = CalcParams(move_depth//3, worst_white_score, worst_black_score, depth_from_root, interesting_moves_to_extend_for)
+    if leaf_mode == LeafMode.EXTENSIONS:
+        check_small_extensions = 1
+        capture_small_extensions = 2
+    else:
+        check_small_extensions = 0
+        capture_small_extensions = 0
     initial_eval, initial_game_phase = eval_piece_vals(b)
-    stats = Stats(initial_eval)
-    params = CalcParams(move_depth, 
-                        ply_depth,
-                        check_big_extensions,
-                        check_small_extensions,
-                        capture_small_extensions,
-                        (SearchEvals.LOSS, chess.WHITE), 
-                        (SearchEvals.LOSS, chess.BLACK), 
-                        depth_from_root, 
-                        initial_eval,
-                        initial_game_phase)
+    stats = Stats(initial_eval, max_distance_from_root + 1)
     quit_early = QuitEarly(initial_eval, initial_game_phase)
-    # a mini search to prepopulate search_order
-    #_ = calc_best_move(b, params_pre_search, quit_early, search_order, repeat_moves_pre_search, stats)
     #sequence_to_track = [chess.Move.from_uci(uci) for uci in ["g1e3", "d8d1", "e3c1", "f6g5"]]
     sequence_to_track = None
-    moves_from_root : list[chess.Move] = []
-    res : SearchRes = calc_best_move(b,
-                         params,
-                         quit_early,
-                         search_order,
-                         repeat_moves,
-                         moves_from_root,
-                         stats,
-                         sequence_to_track)
-    #stats.print()
+    root_key = zobrist.board_key(b)
+    stack = calc_params_stack()
+    root_stack_len = len(b.move_stack)
+    # in a tablebase position, only the moves that keep the best result are
+    # worth searching
+    root_filter = tablebases.root_moves(b) if tablebases is not None else None
+
+    iteration_depth = min(first_depth, move_depth)
+    res : Optional[SearchRes] = None
+    # the root moves the current search_root call has scored so far
+    root_moves : list[Tuple[chess.Move, int]] = []
+    positions_explored = 0
+    iteration = 0
+    while True:
+        iteration += 1
+        iteration_start = clock.elapsed()
+        iteration_positions_before = positions_explored
+        # aspiration window: expect the score to stay close to the last
+        # iteration's, and widen the window on whichever side it falls out
+        low, high = -infinite_score, infinite_score
+        delta = aspiration_delta
+        if res is not None and res.sorted_moves[0] == SearchEvals.SUBMOVE_LIST:
+            last_score = round(float_of_eval(res.sorted_moves))
+            if abs(last_score) < mate_bound:
+                low, high = last_score - delta, last_score + delta
+        iteration_res : Optional[SearchRes] = None
+        try:
+            while True:
+                params = stack[0]
+                params.move_depth = iteration_depth
+                params.ply_depth = ply_depth
+                params.check_big_extensions = check_big_extensions
+                params.check_small_extensions = check_small_extensions
+                params.capture_small_extensions = capture_small_extensions
+                params.white_can_get = low
+                params.black_can_get = high
+                params.current_eval = initial_eval
+                params.current_game_phase = initial_game_phase
+                params.zobrist_key = root_key
+                params.quiescence = leaf_mode == LeafMode.QUIESCENCE
+                params.null_move = null_move
+                params.late_move_reductions = late_move_reductions
+                params.extended = False
+                root_moves = []
+                attempt_positions_before = clock.positions_explored
+                iteration_res = search_root(b,
+                                            stack,
+                                            quit_early,
+                                            search_order,
+                                            tt,
+                                            tablebases,
+                                            clock,
+                                            stats,
+                                            sequence_to_track,
+                                            root_filter,
+                                            expected_move,
+                                            root_moves)
+                positions_explored += iteration_res.positions_explored
+                if iteration_res.sorted_moves[0] == SearchEvals.FORCED:
+                    break
+                score = round(float_of_eval(iteration_res.sorted_moves))
+                if low < score < high:
+                    break
+                stats.aspiration_re_searches += 1
+                delta *= aspiration_growth
+                if score <= low:
+                    low = max(score - delta, -infinite_score)
+                if score >= high:
+                    high = min(score + delta, infinite_score)
+        except SearchAborted:
+            # leave [b] as it was given to us
+            while len(b.move_stack) > root_stack_len:
+                b.pop()
+            positions_explored += clock.positions_explored - attempt_positions_before
+            if res is None:
+                res = unfinished_root_res(b, root_moves, search_order, root_filter,
+                                          expected_move, initial_eval)
+            break
+        assert iteration_res is not None
+        res = iteration_res
+        stats.iterations.append((iteration_depth, 
+                                 positions_explored - iteration_positions_before, 
+                                 clock.elapsed()))
+        if on_iteration is not None and res.sorted_moves[0] == SearchEvals.SUBMOVE_LIST:
+            pv = principal_variation(b, tt, best_move_of_eval(res.sorted_moves))
+            on_iteration(iteration, positions_explored, res, pv)
+        if iteration_depth >= move_depth or res.sorted_moves[0] == SearchEvals.FORCED:
+            break
+        if not clock.can_start_iteration(clock.elapsed() - iteration_start, iteration_growth):
+            break
+        iteration_depth = min(iteration_depth * iteration_growth, move_depth)
+
+    assert res is not None
+    res.positions_explored = positions_explored
     #print(res)
-    return (res, stats)
\ No newline at end of file
+    return (res, stats)
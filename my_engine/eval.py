@@ -1,33 +1,177 @@
+# Samples for score_variance.ipynb: for each FEN, its eval and game phase, and
+# the sum of the squared evals two plies on (after every legal move and every
+# ninth reply to it). FENs are read a chunk at a time and spread over worker
+# processes, and each chunk is written to its own file in the output
+# directory once it is finished, so a run that was stopped skips the chunks
+# already there when started again.
 import chess
-from typing import Callable
+import csv
+import json
+import os
+import time
+import numpy as np
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Iterator, TextIO
+
 from my_engine import eval_piece_vals
+from my_engine.move_record import MoveRecord, legal_moves, move_record
 
 large_difference = 1500
 
-eval_functions : list[Callable[[chess.Board], float]] = [eval_piece_vals.eval_piece_vals]
-
-def eval(b: chess.Board) -> float:
-    return sum([eval_f(b) for eval_f in eval_functions])
-    
-def main(fens: str) -> None:
-    print("base,sum_square_diffs,phase")
-    with open(fens, 'r') as f:
-        for line in f:
-            fen = line.strip()
-            b = chess.Board(fen)
-            base = eval(b)
-            phase = eval_piece_vals.game_phase(b)
-            sum_square_diffs = 0.
-            print(f"{base}, ", end="")
-            moves = list(b.legal_moves)
-            for move in moves:
-                b.push(move)
-                moves2 = list(b.legal_moves)
-                for move2 in moves2[::9]:
-                    b.push(move2)
-                    node = eval(b)
-                    sum_square_diffs += node * node
-                    b.pop()
-                b.pop()
-            print(f"{sum_square_diffs}, ", end="")
-            print(f"{phase}")
\ No newline at end of file
+# every reply_stride'th reply to each move is sampled
+reply_stride = 9
+
+columns = ["base", "sum_square_diffs", "phase", "fen"]
+Row = tuple[float, float, float, str]
+
+# Values by piece_index * 64 + square, as in eval_piece_vals, with a zero
+# entry at no_piece for moves that don't capture.
+no_piece = 12 * 64
+mg_values = np.array(eval_piece_vals.mg_flat + [0], dtype=np.float64)
+eg_values = np.array(eval_piece_vals.eg_flat + [0], dtype=np.float64)
+phase_values = np.array([eval_piece_vals.game_phase_flat[idx // 64 % 6 + 1]
+                         for idx in range(no_piece)] + [0], dtype=np.float64)
+
+# Where the moving piece comes from and goes to, the captured piece and,
+# when castling, where the rook comes from and goes to, as indexes into the
+# value arrays (no_piece where there is nothing). A move changes the values
+# by values[end] - values[start] - values[captured] + values[rook_to] -
+# values[rook_from].
+def move_indices(turn: chess.Color, record: MoveRecord) -> tuple[int, int, int, int, int]:
+    offset = 0 if turn == chess.WHITE else 6 * 64
+    move = record.move
+    from_square, to_square = move.from_square, move.to_square
+    start = offset + (record.piece_type - 1) * 64 + from_square
+    end = offset + ((record.promotion or record.piece_type) - 1) * 64 + to_square
+    captured = (6 * 64 - offset) + (record.captured - 1) * 64 + record.capture_square \
+        if record.captured else no_piece
+    rook_from = rook_to = no_piece
+    if record.piece_type == chess.KING and abs(from_square - to_square) == 2:
+        rook_offset = offset + (chess.ROOK - 1) * 64
+        if to_square > from_square:
+            rook_from, rook_to = rook_offset + to_square + 1, rook_offset + to_square - 1
+        else:
+            rook_from, rook_to = rook_offset + to_square - 2, rook_offset + to_square + 1
+    return start, end, captured, rook_from, rook_to
+
+def value_change(values: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    return values[indices[:, 1]] - values[indices[:, 0]] - values[indices[:, 2]] \
+        + values[indices[:, 4]] - values[indices[:, 3]]
+
+# The eval is phase * (sum of mg values) + (1 - phase) * (sum of eg values),
+# so the evals two plies on come from the sums at the root and the two
+# moves' changes to them, without setting up either position.
+def sample_position(fen: str) -> Row:
+    b = chess.Board(fen)
+    base, phase = eval_piece_vals.eval_piece_vals(b)
+    pieces = np.array([eval_piece_vals.piece_index(piece.piece_type, piece.color) * 64 + square
+                       for square, piece in b.piece_map().items()], dtype=np.int64)
+    mg_sum, eg_sum = mg_values[pieces].sum(), eg_values[pieces].sum()
+
+    firsts : list[tuple[int, int, int, int, int]] = []
+    seconds : list[tuple[int, int, int, int, int]] = []
+    for record in legal_moves(b):
+        first = move_indices(b.turn, record)
+        b.push(record.move)
+        for reply in list(b.generate_legal_moves())[::reply_stride]:
+            firsts.append(first)
+            seconds.append(move_indices(b.turn, move_record(b, reply)))
+        b.pop()
+    if not firsts:
+        return base, 0., phase, fen
+
+    first_idx = np.array(firsts, dtype=np.int64)
+    second_idx = np.array(seconds, dtype=np.int64)
+    node_phase = phase + (value_change(phase_values, first_idx)
+                          + value_change(phase_values, second_idx)) / 24.
+    node_mg = mg_sum + value_change(mg_values, first_idx) + value_change(mg_values, second_idx)
+    node_eg = eg_sum + value_change(eg_values, first_idx) + value_change(eg_values, second_idx)
+    nodes = node_phase * node_mg + (1. - node_phase) * node_eg
+    return base, float(np.dot(nodes, nodes)), phase, fen
+
+# Runs in a worker process.
+def sample_chunk(fens: list[str]) -> list[Row]:
+    return [sample_position(fen) for fen in fens]
+
+def chunk_path(out: str, chunk_idx: int, format: str) -> str:
+    return os.path.join(out, f"chunk-{chunk_idx:06d}.{format}")
+
+# Written under a temporary name and renamed, so a chunk file is either
+# complete or missing.
+def write_chunk(path: str, rows: list[Row], format: str) -> None:
+    tmp_path = path + ".tmp"
+    if format == "parquet":
+        # optional: only needed for parquet output
+        import pyarrow  # type: ignore[import-not-found]
+        import pyarrow.parquet  # type: ignore[import-not-found]
+        table = pyarrow.table({column: [row[idx] for row in rows]
+                               for idx, column in enumerate(columns)})
+        pyarrow.parquet.write_table(table, tmp_path)
+    else:
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+def read_chunks(f: TextIO, chunk_size: int) -> Iterator[list[str]]:
+    fens = (line.strip() for line in f if line.strip())
+    while chunk := list(islice(fens, chunk_size)):
+        yield chunk
+
+# A restarted run has to cut the FENs into the same chunks as the run it
+# carries on from.
+def check_manifest(out: str, fens: str, chunk_size: int, format: str) -> None:
+    manifest = {"fens": os.path.abspath(fens), "chunk_size": chunk_size, "format": format}
+    path = os.path.join(out, "manifest.json")
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            existing = json.load(f)
+        if existing != manifest:
+            raise ValueError(f"{out} was started with {existing}, not {manifest}")
+        return
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+def main(fens: str, out: str, jobs: int = 1, chunk_size: int = 1000, format: str = "csv") -> None:
+    os.makedirs(out, exist_ok=True)
+    check_manifest(out, fens, chunk_size, format)
+    with open(fens, "r") as f:
+        total_chunks = -(-sum(1 for line in f if line.strip()) // chunk_size)
+
+    start = time.monotonic()
+    # chunks finished by earlier runs count as done
+    done = sum(os.path.exists(chunk_path(out, chunk_idx, format))
+               for chunk_idx in range(total_chunks))
+    positions = 0
+    def finished(chunk_idx: int, rows: list[Row]) -> None:
+        nonlocal done, positions
+        write_chunk(chunk_path(out, chunk_idx, format), rows, format)
+        done += 1
+        positions += len(rows)
+        rate = positions / (time.monotonic() - start)
+        print(f"chunk {chunk_idx} done, {done}/{total_chunks} chunks, "
+              f"{rate:.0f} positions/s", flush=True)
+
+    with open(fens, "r") as f:
+        todo = ((chunk_idx, chunk) for chunk_idx, chunk in enumerate(read_chunks(f, chunk_size))
+                if not os.path.exists(chunk_path(out, chunk_idx, format)))
+        if jobs <= 1:
+            for chunk_idx, chunk in todo:
+                finished(chunk_idx, sample_chunk(chunk))
+        else:
+            with ProcessPoolExecutor(jobs) as pool:
+                # a couple of chunks queued per worker, so FENs are read as
+                # they're needed rather than all up front
+                running : dict[Future, int] = {}
+                for chunk_idx, chunk in todo:
+                    running[pool.submit(sample_chunk, chunk)] = chunk_idx
+                    if len(running) >= 2 * jobs:
+                        finished_futures, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in finished_futures:
+                            finished(running.pop(future), future.result())
+                for future in list(running):
+                    finished(running.pop(future), future.result())
+    print(f"{positions} positions sampled in {time.monotonic() - start:.1f}s, "
+          f"{done}/{total_chunks} chunks in {out}")
@@ -1,6 +1,7 @@
 import chess
-from line_profiler import profile
-from typing import Tuple
+from my_engine.instrument import profile
+from typing import Iterable, Tuple
+from my_engine.move_record import MoveRecord
 
 # https://www.chessprogramming.org/PeSTO%27s_Evaluation_Function
 mg_base_value : dict[chess.PieceType, int] = { chess.PAWN:82, chess.KNIGHT:337, chess.BISHOP:365, chess.ROOK:477, chess.QUEEN:1025,  chess.KING:0 }
@@ -156,20 +157,32 @@ eg_tables = {
     chess.KING:eg_king_table
 }
 
+# Flat tables indexed by piece_index(piece_type, color) * 64 + square, folded
+# together once at import. Each entry is the base value plus the square bonus,
+# mirrored for black and negated so black pieces count against white.
+def piece_index(piece_type: chess.PieceType, color: chess.Color) -> int:
+    return (piece_type - 1) + (0 if color == chess.WHITE else 6)
+
+def flat_table(base_value: dict[chess.PieceType, int], 
+               tables: dict[chess.PieceType, list[int]]) -> list[int]:
+    flat = [0] * (12 * 64)
+    for color in chess.COLORS:
+        mult = 1 if color == chess.WHITE else -1
+        for piece_type in chess.PIECE_TYPES:
+            for square in chess.SQUARES:
+                # the tables are laid out from a8 to h1, from white's side
+                table_square = square ^ 56 if color == chess.WHITE else square
+                flat[piece_index(piece_type, color) * 64 + square] = \
+                    mult * (base_value[piece_type] + tables[piece_type][table_square])
+    return flat
+
+mg_flat = flat_table(mg_base_value, mg_tables)
+eg_flat = flat_table(eg_base_value, eg_tables)
+
 @profile
 def piece_values(square:chess.Square, piece:chess.Piece) -> tuple[float, float]:
-    mg_base = mg_base_value[piece.piece_type]
-    eg_base = eg_base_value[piece.piece_type]
-    mg_add_table = mg_tables[piece.piece_type] 
-    eg_add_table = eg_tables[piece.piece_type]
-    mult = 1
-    if piece.color == chess.BLACK:
-        square = chess.square_mirror(square)
-        mult = -1
-    position = 64 - ((8 * chess.square_rank(square)) + (8 - chess.square_file(square)))
-    mg_add = mg_add_table[position]
-    eg_add = eg_add_table[position]
-    return (mg_base + mg_add) * mult, (eg_base + eg_add) * mult
+    idx = piece_index(piece.piece_type, piece.color) * 64 + square
+    return mg_flat[idx], eg_flat[idx]
 
 @profile
 def piece_value(square:chess.Square, piece:chess.Piece, mg_eg_ratio:float) -> float:
@@ -178,61 +191,113 @@ def piece_value(square:chess.Square, piece:chess.Piece, mg_eg_ratio:float) -> fl
 
 game_phase_table : dict[chess.PieceType, int] =\
     {chess.PAWN:0, chess.KNIGHT:1, chess.BISHOP:1, chess.ROOK:2, chess.QUEEN:4, chess.KING:0}
+# indexed by piece type
+game_phase_flat = [0] + [game_phase_table[piece_type] for piece_type in chess.PIECE_TYPES]
+
 @profile
-def game_phase(squares_and_pieces: list[Tuple[chess.Square, chess.Piece]]) -> float:
-    totals = [game_phase_table[piece.piece_type] for _, piece in squares_and_pieces]
-    res = float(sum(totals)) / 24.
+def game_phase(squares_and_pieces: Iterable[Tuple[chess.Square, chess.Piece]]) -> float:
+    res = float(sum([game_phase_flat[piece.piece_type] for _, piece in squares_and_pieces])) / 24.
     return res
     
 @profile
 def eval_piece_vals(b: chess.Board) -> tuple[float, float]:
     squares_and_pieces = b.piece_map().items()
     mg_eg_ratio = game_phase(squares_and_pieces)
-    scores = [piece_value(square, piece, mg_eg_ratio) for square, piece in squares_and_pieces]
-    return sum(scores), mg_eg_ratio
+    indices = [piece_index(piece.piece_type, piece.color) * 64 + square
+               for square, piece in squares_and_pieces]
+    # the values are ints, so tapering the two sums once is exact and gives
+    # the same floats as batch_eval
+    mg_score = sum([mg_flat[idx] for idx in indices])
+    eg_score = sum([eg_flat[idx] for idx in indices])
+    return mg_score * mg_eg_ratio + eg_score * (1. - mg_eg_ratio), mg_eg_ratio
 
 @profile
 def diff(b:chess.Board, move:chess.Move, game_phase:float) -> tuple[float, float]:
     game_phase_diff = 0.
-    mg_piece_evals = 0.
-    eg_piece_evals = 0.
-    start_piece = b.piece_at(move.from_square)
-    assert start_piece is not None
+    from_square, to_square = move.from_square, move.to_square
+    start_type = b.piece_type_at(from_square)
+    assert start_type is not None
+    offset = 0 if b.turn == chess.WHITE else 6 * 64
     if (end_type := move.promotion):
-        game_phase_diff -= game_phase_table[start_piece.piece_type]
-        game_phase_diff += game_phase_table[end_type]
+        game_phase_diff -= game_phase_flat[start_type]
+        game_phase_diff += game_phase_flat[end_type]
     else:
-        end_type = start_piece.piece_type
-    mg_start, eg_start = piece_values(move.from_square, start_piece)
-    mg_end, eg_end = piece_values(move.to_square, chess.Piece(end_type, b.turn))
-    mg_piece_evals -= mg_start
-    eg_piece_evals -= eg_start
-    mg_piece_evals += mg_end
-    eg_piece_evals += eg_end
-    #print(mg_start, eg_start, mg_end, eg_end)
+        end_type = start_type
+    start_idx = offset + (start_type - 1) * 64 + from_square
+    end_idx = offset + (end_type - 1) * 64 + to_square
+    mg_piece_evals = 0. - mg_flat[start_idx] + mg_flat[end_idx]
+    eg_piece_evals = 0. - eg_flat[start_idx] + eg_flat[end_idx]
     
-    if b.is_capture(move):
-        end_rank = chess.square_rank(move.to_square)
-        capture_file = chess.square_file(move.to_square)
-        if b.is_en_passant(move):
-            capture_rank = 3 if end_rank == 2 else 4
-        else:
-            capture_rank = end_rank
-
-        capture_square = chess.square(capture_file, capture_rank)
-        captured_piece = b.piece_at(capture_square)
-        if not captured_piece:
-            raise ValueError(b, move, b.is_en_passant(move), capture_file, capture_rank)
-        mg_captured, eg_captured = piece_values(capture_square, captured_piece)
-        #print(mg_captured, eg_captured)
-        mg_piece_evals -= mg_captured
-        eg_piece_evals -= eg_captured
-        game_phase_diff -= game_phase_table[captured_piece.piece_type]
+    captured_type = b.piece_type_at(to_square)
+    capture_square = to_square
+    if captured_type is None and start_type == chess.PAWN and to_square == b.ep_square:
+        capture_square = to_square ^ 8
+        captured_type = chess.PAWN
+    if captured_type is not None:
+        captured_idx = (6 * 64 - offset) + (captured_type - 1) * 64 + capture_square
+        mg_piece_evals -= mg_flat[captured_idx]
+        eg_piece_evals -= eg_flat[captured_idx]
+        game_phase_diff -= game_phase_flat[captured_type]
         
-    #print(mg_piece_evals, eg_piece_evals)
     game_phase_diff /= 24.
     updated_game_phase = game_phase + game_phase_diff
     piece_evals_diff = \
         updated_game_phase * mg_piece_evals + \
         (1. - updated_game_phase) * eg_piece_evals
-    return (piece_evals_diff, game_phase_diff)
\ No newline at end of file
+    return (piece_evals_diff, game_phase_diff)
+
+# diff, for a move whose mover and capture the caller already knows.
+@profile
+def record_diff(turn:chess.Color, record:MoveRecord, game_phase:float) -> tuple[float, float]:
+    offset = 0 if turn == chess.WHITE else 6 * 64
+    from_square, to_square = record.move.from_square, record.move.to_square
+    start_type = record.piece_type
+    end_type = record.promotion or start_type
+    start_idx = offset + (start_type - 1) * 64 + from_square
+    end_idx = offset + (end_type - 1) * 64 + to_square
+    mg_piece_evals = 0. - mg_flat[start_idx] + mg_flat[end_idx]
+    eg_piece_evals = 0. - eg_flat[start_idx] + eg_flat[end_idx]
+    game_phase_diff = 0. - game_phase_flat[start_type] + game_phase_flat[end_type] \
+        if end_type != start_type else 0.
+
+    if (captured_type := record.captured):
+        captured_idx = (6 * 64 - offset) + (captured_type - 1) * 64 + record.capture_square
+        mg_piece_evals -= mg_flat[captured_idx]
+        eg_piece_evals -= eg_flat[captured_idx]
+        game_phase_diff -= game_phase_flat[captured_type]
+
+    game_phase_diff /= 24.
+    updated_game_phase = game_phase + game_phase_diff
+    return (updated_game_phase * mg_piece_evals + (1. - updated_game_phase) * eg_piece_evals,
+            game_phase_diff)
+
+# record_diff for every move of a position in one go, for frontier nodes
+# where most children are leaves.
+@profile
+def diffs(turn:chess.Color, records:list[MoveRecord], game_phase:float) -> list[tuple[float, float]]:
+    offset = 0 if turn == chess.WHITE else 6 * 64
+    opponent_offset = 6 * 64 - offset
+    res = []
+    for record in records:
+        move = record.move
+        from_square, to_square = move.from_square, move.to_square
+        start_type = record.piece_type
+        end_type = record.promotion or start_type
+        start_idx = offset + (start_type - 1) * 64 + from_square
+        end_idx = offset + (end_type - 1) * 64 + to_square
+        mg_piece_evals = 0. - mg_flat[start_idx] + mg_flat[end_idx]
+        eg_piece_evals = 0. - eg_flat[start_idx] + eg_flat[end_idx]
+        game_phase_diff = 0. - game_phase_flat[start_type] + game_phase_flat[end_type] \
+            if end_type != start_type else 0.
+
+        if (captured_type := record.captured):
+            captured_idx = opponent_offset + (captured_type - 1) * 64 + record.capture_square
+            mg_piece_evals -= mg_flat[captured_idx]
+            eg_piece_evals -= eg_flat[captured_idx]
+            game_phase_diff -= game_phase_flat[captured_type]
+
+        game_phase_diff /= 24.
+        updated_game_phase = game_phase + game_phase_diff
+        res.append((updated_game_phase * mg_piece_evals + (1. - updated_game_phase) * eg_piece_evals,
+                    game_phase_diff))
+    return res
@@ -0,0 +1,92 @@
+# Call counts and timings for the hot functions, decorated with @profile.
+# Decorators run at import, so instrumentation is switched on by setting
+# MY_ENGINE_INSTRUMENT=1 before the engine is started. When it's off,
+# @profile hands functions back untouched, so searches run exactly the code
+# they would without it.
+import functools
+import json
+import os
+import time
+from typing import Any, Callable, TypeVar
+
+enabled = os.environ.get("MY_ENGINE_INSTRUMENT", "") not in ["", "0"]
+
+class FunctionStats:
+    __slots__ = ("calls", "seconds", "active")
+    calls: int
+    # cumulative: time spent inside the function, counting the functions it
+    # calls, but only from its outermost call when it recurses
+    seconds: float
+    active: bool
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.
+        self.active = False
+
+# by module and qualified name
+functions : dict[str, FunctionStats] = {}
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+def profile(fn: F) -> F:
+    if not enabled:
+        return fn
+    record = functions.setdefault(f"{fn.__module__}.{fn.__qualname__}", FunctionStats())
+    perf_counter = time.perf_counter
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        record.calls += 1
+        if record.active:
+            return fn(*args, **kwargs)
+        record.active = True
+        start = perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            record.seconds += perf_counter() - start
+            record.active = False
+    return wrapper  # type: ignore
+
+Snapshot = dict[str, dict[str, float]]
+
+def snapshot() -> Snapshot:
+    return {name: {"calls": record.calls, "seconds": record.seconds}
+            for name, record in functions.items() if record.calls}
+
+def reset() -> None:
+    for record in functions.values():
+        record.calls = 0
+        record.seconds = 0.
+
+# What was counted since [before] was taken.
+def since(before: Snapshot) -> Snapshot:
+    counts = snapshot()
+    for name, one in counts.items():
+        if name in before:
+            one["calls"] -= before[name]["calls"]
+            one["seconds"] -= before[name]["seconds"]
+    return {name: one for name, one in counts.items() if one["calls"]}
+
+# Adds up snapshots, e.g. from several worker processes.
+def merge(snapshots: list[Snapshot]) -> Snapshot:
+    total : Snapshot = {}
+    for one in snapshots:
+        for name, counts in one.items():
+            into = total.setdefault(name, {"calls": 0, "seconds": 0.})
+            into["calls"] += counts["calls"]
+            into["seconds"] += counts["seconds"]
+    return total
+
+def write(path: str, counts: Snapshot) -> None:
+    with open(path, "w") as f:
+        json.dump(counts, f, indent=1, sort_keys=True)
+
+# A table of [counts], slowest first.
+def report(counts: Snapshot) -> list[str]:
+    lines = [f"{'function':<48} {'calls':>12} {'seconds':>10} {'us/call':>10}"]
+    for name, one in sorted(counts.items(), key=lambda item: item[1]["seconds"], reverse=True):
+        per_call = one["seconds"] / one["calls"] * 1e6 if one["calls"] else 0.
+        lines.append(f"{name:<48} {int(one['calls']):>12} {one['seconds']:>10.3f} {per_call:>10.2f}")
+    return lines
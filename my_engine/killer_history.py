@@ -0,0 +1,88 @@
+import chess
+from my_engine.instrument import profile
+
+from my_engine.search_order import SearchOrder
+from my_engine.move_record import MoveRecord
+from my_engine.quiescence import capture_value
+
+# Moves are ordered in bands: captures and promotions (MVV-LVA), then the two
+# killers of the node's distance from the root, then quiet moves by history.
+capture_band = 1 << 24
+killer_band = 1 << 22
+# past this, every history score is halved, so old cutoffs count for less
+# than new ones and scores stay under killer_band
+history_limit = 1 << 20
+
+class KillerHistory(SearchOrder):
+    # quiet moves that caused cutoffs, most recent first, per distance from
+    # the root
+    killers : list[list[chess.Move]]
+    # cutoff bonuses by from_square * 64 + to_square
+    history : list[int]
+
+    def __init__(self, max_distance_from_root: int):
+        self.killers = [[chess.Move.null(), chess.Move.null()]
+                        for _ in range(max_distance_from_root + 1)]
+        self.history = [0] * (64 * 64)
+
+    def age(self) -> None:
+        self.history = [score // 2 for score in self.history]
+
+    # Two plies on, the old root's grandchildren are the new root's, so the
+    # killers move up two distances. History is kept, but counts for less.
+    def new_search(self) -> None:
+        self.killers = self.killers[2:] + [[chess.Move.null(), chess.Move.null()]
+                                           for _ in range(2)]
+        self.age()
+
+    # Only cutoffs teach us anything: at a node where every move was searched
+    # the best move was best by value, not by refuting anything.
+    @profile
+    def update_priors(self,
+                      b: chess.Board,
+                      ordered_moves : list[MoveRecord],
+                      explored_count : int,
+                      best_idx : int,
+                      distance_from_root: int,
+                      move_depth: int,
+                      scores: list[int]) -> None:
+        if explored_count == len(ordered_moves):
+            return
+        record = ordered_moves[best_idx]
+        if record.captured or record.promotion:
+            return
+        move = record.move
+        killers = self.killers[distance_from_root]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        # cutoffs with more budget below them count for more
+        idx = move.from_square * 64 + move.to_square
+        self.history[idx] += move_depth.bit_length() ** 2
+        if self.history[idx] > history_limit:
+            self.age()
+
+    @profile
+    def order_moves(self, 
+                    b: chess.Board, 
+                    moves: list[MoveRecord], 
+                    distance_from_root: int) -> list[MoveRecord]:
+        first_killer, second_killer = self.killers[distance_from_root]
+        history = self.history
+        scored : list[tuple[int, MoveRecord]] = []
+        for record in moves:
+            move = record.move
+            if record.captured or record.promotion:
+                gain = capture_value[record.captured]
+                if record.promotion:
+                    gain += capture_value[record.promotion] - capture_value[chess.PAWN]
+                score = capture_band + gain * 8 - record.piece_type
+            elif move == first_killer:
+                score = killer_band + 1
+            elif move == second_killer:
+                score = killer_band
+            else:
+                score = history[move.from_square * 64 + move.to_square]
+            scored.append((score, record))
+        scored.sort(key=lambda scored_move: scored_move[0], reverse=True)
+        return [record for _, record in scored]
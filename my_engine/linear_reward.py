@@ -1,6 +1,7 @@
 import chess
 from my_engine.search_order import SearchOrder
-from line_profiler import profile
+from my_engine.move_record import MoveRecord
+from my_engine.instrument import profile
 
 def score_add(place: int) -> int:
     return 3000 - (place * 150)
@@ -20,17 +21,32 @@ class LinearReward(SearchOrder):
         score = self.move_priors.get(move, default_score())
         return score
 
-    def update_priors(self, sorted_moves : list[chess.Move]) -> None:
-        for place, move in enumerate(sorted_moves):
+    # the explored moves take places by their scores, best for the side to
+    # move first
+    def update_priors(self, 
+                      b : chess.Board,
+                      ordered_moves : list[MoveRecord], 
+                      explored_count : int, 
+                      best_idx : int,
+                      distance_from_root : int,
+                      move_depth : int,
+                      scores : list[int]) -> None:
+        ranked = sorted(range(explored_count), key=lambda idx: scores[idx], 
+                        reverse=b.turn == chess.WHITE)
+        for place, idx in enumerate(ranked):
+            move = ordered_moves[idx].move
             old_prior = self.prior(move)
             add_score = score_add(place)
             self.move_priors[move] = (old_prior[0] + add_score, old_prior[1] + 1)
     
     @profile
-    def order_moves(self, b:chess.Board) -> list[chess.Move]:
-        moves : list[tuple[chess.Move, tuple[int, int]]] = \
-            [(move, self.prior(move)) for move in b.legal_moves]
-        sorted_moves = sorted(moves, 
+    def order_moves(self, 
+                    b:chess.Board, 
+                    moves : list[MoveRecord], 
+                    distance_from_root : int) -> list[MoveRecord]:
+        priors : list[tuple[MoveRecord, tuple[int, int]]] = \
+            [(record, self.prior(record.move)) for record in moves]
+        sorted_moves = sorted(priors, 
                               key = lambda x: x[1][0] // x[1][1], 
                               reverse=True)
         
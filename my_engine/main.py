@@ -1,9 +1,19 @@
 import click
+import importlib.util
 from typing import Optional
 from my_engine.uci import main as uci_main 
 from my_engine.perf import main as perf_main
 from my_engine.eval import main as eval_main
+from my_engine.parallel import scaling_main
+from my_engine.selfplay import time_to_depth_main
+from my_engine import bench as bench_module
+from my_engine import instrument
+from my_engine.book import compile_main as compile_book_main
+from my_engine.tune import main as tune_main
+from my_engine.engine import LeafMode, Ordering
 
+leaf_modes = [mode.name.lower() for mode in LeafMode]
+orderings = [ordering.name.lower() for ordering in Ordering]
 
 @click.group()
 def cli():
@@ -15,16 +25,111 @@ def uci(log: str) -> None:
     uci_main(log)
 
 @cli.command()
-@click.option('--linear', is_flag=True, help="Scheme for ordering moves to search")
+@click.option('--ordering', type=click.Choice(orderings), default="random", help="Scheme for ordering moves to search")
+@click.option('--jobs', type=int, default=1, help="Positions to search in parallel")
+@click.option('--out', type=str, default=None, help="File to write one record per position to")
+@click.option('--format', type=click.Choice(["json", "csv"]), default="json", help="Format of --out")
+@click.option('--leaves', type=click.Choice(leaf_modes), default="extensions", help="How the end of the search budget is scored")
+@click.option('--null-move', is_flag=True, help="Try null move pruning")
+@click.option('--lmr', is_flag=True, help="Give moves ordered late less budget")
+@click.option('--profile-out', type=str, default=None, help="File to write call counts and timings to (needs MY_ENGINE_INSTRUMENT=1)")
+@click.option('--telemetry', type=str, default=None, help="File to write one JSON line of search telemetry per position to")
 @click.argument('depth', type=int)
 @click.argument('fens', type=str)
-def perf(depth: int, fens: str, linear: bool) -> None:
-    perf_main(depth, fens, linear)
+def perf(depth: int, 
+         fens: str, 
+         ordering: str, 
+         jobs: int, 
+         out: Optional[str], 
+         format: str, 
+         leaves: str,
+         null_move: bool,
+         lmr: bool,
+         profile_out: Optional[str],
+         telemetry: Optional[str]) -> None:
+    if profile_out is not None and not instrument.enabled:
+        raise click.UsageError("--profile-out needs MY_ENGINE_INSTRUMENT=1")
+    perf_main(depth, fens, Ordering[ordering.upper()], jobs, out, format, LeafMode[leaves.upper()],
+              null_move, lmr, profile_out, telemetry)
 
 @cli.command()
+@click.option('--ordering', type=click.Choice(orderings), default="random", help="Scheme for ordering moves to search")
+@click.option('--threads', type=str, default="1,2,4", help="Comma separated thread counts to compare")
+@click.argument('depth', type=int)
+@click.argument('fens', type=str)
+def scaling(depth: int, fens: str, ordering: str, threads: str) -> None:
+    scaling_main(depth, fens, [int(t) for t in threads.split(",")], Ordering[ordering.upper()])
+
+# Plays a game from each FEN, and compares time to depth of searches that keep
+# the game's session with searches of the same positions from cold.
+@cli.command()
+@click.option('--ordering', type=click.Choice(orderings), default="linear", help="Scheme for ordering moves to search")
+@click.option('--threads', type=int, default=1, help="Threads per search")
+@click.option('--max-plies', type=int, default=60, help="Plies to stop each game after")
+@click.argument('depth', type=int)
+@click.argument('fens', type=str)
+def selfplay(depth: int, fens: str, ordering: str, threads: int, max_plies: int) -> None:
+    time_to_depth_main(depth, fens, max_plies, threads, Ordering[ordering.upper()])
+
+@cli.command()
+@click.option('--ordering', type=click.Choice(orderings), default="random", help="Scheme for ordering moves to search")
+@click.option('--depth', type=int, default=bench_module.default_depth, help="move_depth budget per position")
+@click.option('--leaves', type=click.Choice(leaf_modes), default="extensions", help="How the end of the search budget is scored")
+@click.option('--null-move', is_flag=True, help="Try null move pruning")
+@click.option('--lmr', is_flag=True, help="Give moves ordered late less budget")
+@click.option('--save', type=str, default=None, help="File to save this run to, for use as a baseline")
+@click.option('--baseline', type=str, default=None, help="Saved run to compare against")
+@click.option('--nodes-tolerance', type=float, default=0.05, help="Allowed fractional rise in positions explored")
+@click.option('--nps-tolerance', type=float, default=0.10, help="Allowed fractional drop in nps")
+@click.option('--ttd-tolerance', type=float, default=0.10, help="Allowed fractional rise in time to the deepest iteration")
+def bench(ordering: str, 
+          depth: int, 
+          leaves: str,
+          null_move: bool,
+          lmr: bool,
+          save: Optional[str], 
+          baseline: Optional[str], 
+          nodes_tolerance: float, 
+          nps_tolerance: float,
+          ttd_tolerance: float) -> None:
+    if not bench_module.main(depth, Ordering[ordering.upper()], LeafMode[leaves.upper()], null_move, lmr, save, baseline, nodes_tolerance, nps_tolerance, ttd_tolerance):
+        raise SystemExit(1)
+
+# Compiles move lists into a Polyglot book. Each line of an input is moves
+# from the start, or a FEN then ';' then moves; csv inputs are read from their
+# moves column.
+@cli.command()
+@click.option('--max-ply', type=int, default=24, help="Moves of each line to put in the book")
+@click.argument('out', type=str)
+@click.argument('inputs', type=str, nargs=-1, required=True)
+def book(out: str, inputs: tuple[str, ...], max_ply: int) -> None:
+    compile_book_main(list(inputs), out, max_ply)
+
+# Fits the piece values and square tables to labelled positions, one per
+# line: a FEN, then ';' or ',' and the label (or EPD with a c9 result), and
+# writes them out as a module with the same tables as eval_piece_vals.
+@cli.command()
+@click.option('--scores', is_flag=True, help="Labels are engine scores in centipawns rather than game results")
+@click.option('--epochs', type=int, default=300, help="Gradient descent steps over the whole set")
+@click.option('--learning-rate', type=float, default=1., help="Adam step size, in centipawns")
+@click.option('--k', type=float, default=None, help="Sigmoid scale; fitted to the untuned tables if not given")
+@click.argument('positions', type=str)
+@click.argument('out', type=str)
+def tune(positions: str, out: str, scores: bool, epochs: int, learning_rate: float, k: Optional[float]) -> None:
+    tune_main(positions, out, scores, epochs, learning_rate, k)
+
+# Writes eval variance samples for score_variance.ipynb to OUT, a chunk per
+# file. Run it again with the same arguments to carry on after a stop.
+@cli.command()
+@click.option('--jobs', type=int, default=1, help="Worker processes")
+@click.option('--chunk-size', type=int, default=1000, help="FENs per output file")
+@click.option('--format', type=click.Choice(["csv", "parquet"]), default="csv", help="Format of the chunk files")
 @click.argument('fens', type=str)
-def eval(fens: str) -> None:
-    eval_main(fens)
+@click.argument('out', type=str)
+def eval(fens: str, out: str, jobs: int, chunk_size: int, format: str) -> None:
+    if format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise click.UsageError("--format parquet needs pyarrow")
+    eval_main(fens, out, jobs, chunk_size, format)
 
 if __name__ == "__main__":
     cli()
\ No newline at end of file
@@ -0,0 +1,75 @@
+import chess
+from typing import Optional
+from my_engine.instrument import profile
+
+# What the search needs to know about a legal move, worked out in the one
+# pass over a node's legal moves, so terminal detection, ordering, extensions
+# and the eval delta don't each ask the board again.
+class MoveRecord:
+    __slots__ = ("move", "piece_type", "captured", "capture_square", "promotion", "check")
+    move: chess.Move
+    # type of the moving piece
+    piece_type: chess.PieceType
+    # type of the captured piece, or 0 for moves that don't capture
+    captured: int
+    # where the captured piece stands, which for en passant isn't the
+    # move's to_square
+    capture_square: chess.Square
+    # type of the piece promoted to, or 0
+    promotion: int
+    # whether the move gives check. Few moves get asked, so it's only worked
+    # out on the first ask.
+    check: Optional[bool]
+
+    def __init__(self,
+                 move: chess.Move,
+                 piece_type: chess.PieceType,
+                 captured: int,
+                 capture_square: chess.Square):
+        self.move = move
+        self.piece_type = piece_type
+        self.captured = captured
+        self.capture_square = capture_square
+        self.promotion = move.promotion or 0
+        self.check = None
+
+    # [b] is the position the move is played from.
+    def gives_check(self, b: chess.Board) -> bool:
+        if self.check is None:
+            self.check = b.gives_check(self.move)
+        return self.check
+
+@profile
+def legal_moves(b: chess.Board) -> list[MoveRecord]:
+    them = b.occupied_co[not b.turn]
+    ep_square = b.ep_square
+    piece_type_at = b.piece_type_at
+    records = []
+    # moves come grouped by the square they leave from
+    last_from_square, piece_type = -1, 0
+    for move in b.generate_legal_moves():
+        from_square, to_square = move.from_square, move.to_square
+        if from_square != last_from_square:
+            last_from_square, piece_type = from_square, piece_type_at(from_square) or 0
+        captured = 0
+        capture_square = to_square
+        if them & chess.BB_SQUARES[to_square]:
+            captured = piece_type_at(to_square) or 0
+        elif to_square == ep_square and piece_type == chess.PAWN:
+            captured = chess.PAWN
+            capture_square = to_square ^ 8
+        records.append(MoveRecord(move, piece_type, captured, capture_square))
+    return records
+
+# The record of one legal [move] of [b], for callers that only need a few.
+def move_record(b: chess.Board, move: chess.Move) -> MoveRecord:
+    from_square, to_square = move.from_square, move.to_square
+    piece_type = b.piece_type_at(from_square) or 0
+    captured = 0
+    capture_square = to_square
+    if b.occupied_co[not b.turn] & chess.BB_SQUARES[to_square]:
+        captured = b.piece_type_at(to_square) or 0
+    elif to_square == b.ep_square and piece_type == chess.PAWN:
+        captured = chess.PAWN
+        capture_square = to_square ^ 8
+    return MoveRecord(move, piece_type, captured, capture_square)
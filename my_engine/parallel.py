@@ -0,0 +1,195 @@
+# Lazy SMP: helper processes search the same root as the main search, with
+# iteration budgets staggered between the main search's, and every process
+# shares one transposition table in shared memory. The helpers' results are
+# thrown away; they help the main search through the entries they leave in
+# the table. Processes rather than threads, so the helpers aren't serialised
+# by the GIL.
+import chess
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+from my_engine import engine
+from my_engine.engine import SearchRes, Stats, OnIteration
+from my_engine.transposition import TranspositionTable
+from my_engine.time_manager import SearchClock
+from my_engine.tablebase import Tablebases, open_tablebases
+from my_engine.session import GameSession
+
+# pools are expensive to start, so we keep one around between searches
+pools : dict[int, ProcessPoolExecutor] = {}
+
+def helper_pool(helpers: int) -> ProcessPoolExecutor:
+    if helpers not in pools:
+        for pool in pools.values():
+            pool.shutdown()
+        pools.clear()
+        # spawn rather than fork, since the UCI loop runs searches on a thread
+        pools[helpers] = ProcessPoolExecutor(helpers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=helper_ready)
+        # make the pool start its processes and import the engine now rather
+        # than on the first search, which couldn't stop them until they had
+        warmups = [pools[helpers].submit(helper_ready) for _ in range(helpers)]
+        for warmup in warmups:
+            warmup.result()
+    return pools[helpers]
+
+# Does nothing, but a helper process has to import this module to run it.
+def helper_ready() -> None:
+    pass
+
+def shutdown_pools() -> None:
+    for pool in pools.values():
+        pool.shutdown()
+    pools.clear()
+
+# Helper i of n starts its iterations at a budget i/n of the way (on a log
+# scale) between the main search's first and second iterations.
+def helper_first_depth(helper_idx: int, threads: int) -> int:
+    return int(engine.first_iteration_depth *
+               engine.iteration_growth ** ((helper_idx + 1) / threads))
+
+# Runs in a helper process. Returns the positions it explored.
+def helper_search(fen: str,
+                  move_depth: int,
+                  first_depth: int,
+                  ordering: engine.Ordering,
+                  size_mb: int,
+                  generation: int,
+                  tt_name: str,
+                  stop_name: str,
+                  null_move: bool,
+                  late_move_reductions: bool,
+                  syzygy_path: Optional[str]) -> int:
+    tt_shm = SharedMemory(tt_name)
+    stop_shm = SharedMemory(stop_name)
+    tt_buf, stop_buf = tt_shm.buf, stop_shm.buf
+    assert tt_buf is not None and stop_buf is not None
+    tt = TranspositionTable(size_mb, tt_buf)
+    tt.generation = generation
+    clock = SearchClock()
+    clock.should_stop = lambda: stop_buf[0] != 0
+    try:
+        engine.go(chess.Board(fen), move_depth, ordering, tt, clock, 
+                  first_depth=first_depth, 
+                  null_move=null_move, 
+                  late_move_reductions=late_move_reductions,
+                  tablebases=open_tablebases(syzygy_path) if syzygy_path else None)
+    finally:
+        tt.release()
+        tt_shm.close()
+        stop_shm.close()
+    return clock.positions_explored
+
+# Same as engine.go, but with [threads] - 1 helper processes. The returned
+# positions_explored counts the helpers' positions too. Without a [session],
+# the search starts from an empty table and fresh priors.
+def go(b: chess.Board,
+       move_depth: int,
+       threads: int,
+       ordering: engine.Ordering = engine.Ordering.LINEAR,
+       size_mb: int = engine.default_hash_mb,
+       clock: Optional[SearchClock] = None,
+       on_iteration: Optional[OnIteration] = None,
+       null_move: bool = False,
+       late_move_reductions: bool = False,
+       syzygy_path: Optional[str] = None,
+       session: Optional[GameSession] = None) -> tuple[SearchRes, Stats]:
+    tablebases : Optional[Tablebases] = open_tablebases(syzygy_path) if syzygy_path else None
+    own_session = session is None
+    if session is None:
+        session = GameSession(size_mb, ordering)
+    session.new_search()
+    tt = session.tt
+    expected_move = session.expected_move(b)
+    try:
+        if threads <= 1:
+            res, stats = engine.go(b, move_depth, ordering, tt, clock, on_iteration,
+                                   null_move=null_move, late_move_reductions=late_move_reductions,
+                                   tablebases=tablebases, search_order=session.search_order,
+                                   expected_move=expected_move)
+        else:
+            res, stats = smp_go(b, move_depth, threads, ordering, session, clock, on_iteration,
+                                null_move, late_move_reductions, syzygy_path, tablebases,
+                                expected_move)
+        best_move = engine.best_move_of_eval(res.sorted_moves)
+        session.set_pv(b, engine.principal_variation(b, tt, best_move))
+    finally:
+        if own_session:
+            session.close()
+    return res, stats
+
+def smp_go(b: chess.Board,
+           move_depth: int,
+           threads: int,
+           ordering: engine.Ordering,
+           session: GameSession,
+           clock: Optional[SearchClock],
+           on_iteration: Optional[OnIteration],
+           null_move: bool,
+           late_move_reductions: bool,
+           syzygy_path: Optional[str],
+           tablebases: Optional[Tablebases],
+           expected_move: Optional[chess.Move]) -> tuple[SearchRes, Stats]:
+    pool = helper_pool(threads - 1)
+    stop_shm = SharedMemory(create=True, size=1)
+    stop_buf = stop_shm.buf
+    assert stop_buf is not None
+    stop_buf[0] = 0
+    tt = session.tt
+    helpers = []
+    try:
+        helpers = [pool.submit(helper_search,
+                               b.fen(),
+                               move_depth,
+                               helper_first_depth(helper_idx, threads),
+                               ordering,
+                               session.size_mb,
+                               tt.generation,
+                               session.tt_shm.name,
+                               stop_shm.name,
+                               null_move,
+                               late_move_reductions,
+                               syzygy_path)
+                   for helper_idx in range(threads - 1)]
+        res, stats = engine.go(b, move_depth, ordering, tt, clock, on_iteration,
+                               null_move=null_move, late_move_reductions=late_move_reductions,
+                               tablebases=tablebases, search_order=session.search_order,
+                               expected_move=expected_move)
+    finally:
+        stop_buf[0] = 1
+        helper_positions = sum(helper.result() for helper in helpers)
+        stop_shm.close()
+        stop_shm.unlink()
+    res.positions_explored += helper_positions
+    return res, stats
+
+# Times the same fixed-budget searches at each thread count, and reports the
+# speedup over the first count.
+def scaling_main(depth: int, fens: str, thread_counts: list[int], ordering: engine.Ordering) -> None:
+    with open(fens, 'r') as f:
+        boards = [chess.Board(line.strip()) for line in f if line.strip()]
+
+    base_time : Optional[float] = None
+    base_moves : list[chess.Move] = []
+    print("threads,seconds,positions_explored,speedup,same_best_move")
+    for threads in thread_counts:
+        if threads > 1:
+            helper_pool(threads - 1)
+        start = time.monotonic()
+        positions_explored = 0
+        best_moves = []
+        for b in boards:
+            res, _ = go(b, depth, threads, ordering)
+            positions_explored += res.positions_explored
+            best_moves.append(engine.best_move_of_eval(res.sorted_moves))
+        seconds = time.monotonic() - start
+        if base_time is None:
+            base_time, base_moves = seconds, best_moves
+        same = sum(move == base_move for move, base_move in zip(best_moves, base_moves))
+        print(f"{threads},{seconds:.2f},{positions_explored},"
+              f"{base_time / seconds:.2f},{same}/{len(boards)}", flush=True)
+    shutdown_pools()
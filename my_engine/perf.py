@@ -1,12 +1,114 @@
 import chess
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterator, Optional, TextIO
 from my_engine import engine
+from my_engine import instrument
 
-def main(depth:int, fens: str, linear: bool) -> None:
+Record = dict[str, Any]
+
+def perf_position(fen: str, depth: int, ordering: engine.Ordering, 
+                  leaf_mode: engine.LeafMode = engine.LeafMode.EXTENSIONS,
+                  null_move: bool = False,
+                  late_move_reductions: bool = False) -> Record:
+    b = chess.Board(fen)
+    instrument.reset()
+    start = time.monotonic()
+    res, stats = engine.go(b, depth, ordering, 
+                           leaf_mode=leaf_mode, 
+                           null_move=null_move, 
+                           late_move_reductions=late_move_reductions)
+    seconds = time.monotonic() - start
+    record = {"fen": fen,
+              "positions_explored": res.positions_explored,
+              "seconds": seconds,
+              "nps": res.positions_explored / seconds if seconds > 0 else 0.,
+              "best_move": engine.best_move_of_eval(res.sorted_moves).uci(),
+              "ordering": ordering.value,
+              "leaf_mode": leaf_mode.value,
+              "null_move": null_move,
+              "late_move_reductions": late_move_reductions,
+              "initial_eval": stats.initial_eval,
+              "final_eval": engine.float_of_eval(res.sorted_moves),
+              **stats.counters()}
+    # taken back out by main, since they don't fit a csv row
+    profile = instrument.snapshot() if instrument.enabled else None
+    if profile is not None:
+        record["profile"] = profile
+    record["telemetry"] = {"fen": fen, **stats.report(res.positions_explored, seconds, profile)}
+    return record
+
+def perf_positions(fens: list[str], 
+                   depth: int, 
+                   ordering: engine.Ordering, 
+                   jobs: int, 
+                   leaf_mode: engine.LeafMode,
+                   null_move: bool,
+                   late_move_reductions: bool) -> Iterator[Record]:
+    if jobs <= 1:
+        for fen in fens:
+            yield perf_position(fen, depth, ordering, leaf_mode, null_move, late_move_reductions)
+        return
+    with ProcessPoolExecutor(jobs) as pool:
+        # map hands back records in the order of [fens]
+        yield from pool.map(perf_position, fens, [depth] * len(fens), [ordering] * len(fens),
+                            [leaf_mode] * len(fens), [null_move] * len(fens), 
+                            [late_move_reductions] * len(fens))
+
+def write_record(out: TextIO, format: str, record: Record, writer: Optional[csv.DictWriter]) -> None:
+    if format == "json":
+        out.write(json.dumps(record) + "\n")
+    else:
+        assert writer is not None
+        # per depth counters go in as json lists
+        writer.writerow({k: json.dumps(v) if isinstance(v, list) else v for k, v in record.items()})
+    out.flush()
+
+def main(depth:int, 
+         fens: str, 
+         ordering: engine.Ordering, 
+         jobs: int = 1, 
+         out: Optional[str] = None, 
+         format: str = "json",
+         leaf_mode: engine.LeafMode = engine.LeafMode.EXTENSIONS,
+         null_move: bool = False,
+         late_move_reductions: bool = False,
+         profile_out: Optional[str] = None,
+         telemetry_out: Optional[str] = None) -> None:
     with open(fens, 'r') as f:
-        for line in f:
-            fen = line.strip()
-            b = chess.Board(fen)
-            res, stats = engine.go(b, depth, linear)
-            print(f"fen: {fen}")
-            print(f"initial_eval: {stats.initial_eval:.3f} final_eval: {engine.float_of_eval(res.sorted_moves)}")
-            print(f"best move: {engine.best_move_of_eval(res.sorted_moves)}")
\ No newline at end of file
+        fen_list = [line.strip() for line in f if line.strip()]
+
+    out_file = open(out, "w") if out is not None else None
+    telemetry_file = open(telemetry_out, "w") if telemetry_out is not None else None
+    writer : Optional[csv.DictWriter] = None
+    profiles : list[instrument.Snapshot] = []
+    try:
+        for record in perf_positions(fen_list, depth, ordering, jobs, leaf_mode, 
+                                     null_move, late_move_reductions):
+            if "profile" in record:
+                profiles.append(record.pop("profile"))
+            search_telemetry = record.pop("telemetry")
+            if telemetry_file is not None:
+                telemetry_file.write(json.dumps(search_telemetry) + "\n")
+                telemetry_file.flush()
+            print(f"fen: {record['fen']}")
+            print(f"initial_eval: {record['initial_eval']:.3f} final_eval: {record['final_eval']}")
+            print(f"best move: {record['best_move']}")
+            if out_file is not None:
+                if format == "csv" and writer is None:
+                    writer = csv.DictWriter(out_file, fieldnames=list(record.keys()))
+                    writer.writeheader()
+                write_record(out_file, format, record, writer)
+    finally:
+        if out_file is not None:
+            out_file.close()
+        if telemetry_file is not None:
+            telemetry_file.close()
+
+    if instrument.enabled:
+        profile = instrument.merge(profiles)
+        print("\n".join(instrument.report(profile)))
+        if profile_out is not None:
+            instrument.write(profile_out, profile)
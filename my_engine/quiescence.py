@@ -0,0 +1,99 @@
+import chess
+from my_engine.instrument import profile
+
+from my_engine.eval_piece_vals import mg_base_value, eg_base_value, diff as piece_vals_diff
+from my_engine.time_manager import SearchClock
+
+# what a piece is worth when ordering captures and deciding which can't
+# matter, indexed by piece type
+capture_value : list[int] = [0] + [max(mg_base_value[piece_type], eg_base_value[piece_type])
+                                   for piece_type in chess.PIECE_TYPES]
+
+# how far a capture can leave the side to move short of its window and still
+# be searched, since the piece-square part of the eval moves too
+delta_margin = 200
+
+def victim_type(b: chess.Board, move: chess.Move) -> chess.PieceType:
+    if b.is_en_passant(move):
+        return chess.PAWN
+    victim = b.piece_type_at(move.to_square)
+    assert victim is not None
+    return victim
+
+# The most material a capture can win.
+def capture_gain(b: chess.Board, move: chess.Move) -> int:
+    gain = capture_value[victim_type(b, move)]
+    if move.promotion:
+        gain += capture_value[move.promotion] - capture_value[chess.PAWN]
+    return gain
+
+# Legal captures with their capture_gain, most valuable victim first and
+# least valuable attacker first among equal victims (MVV-LVA).
+@profile
+def ordered_captures(b: chess.Board) -> list[tuple[chess.Move, int]]:
+    captures = []
+    for move in b.generate_legal_captures():
+        attacker = b.piece_type_at(move.from_square)
+        assert attacker is not None
+        gain = capture_gain(b, move)
+        captures.append((gain * 8 - attacker, move, gain))
+    captures.sort(key=lambda capture: capture[0], reverse=True)
+    return [(move, gain) for _, move, gain in captures]
+
+# Scores a leaf by searching captures until the position is quiet. The side
+# to move can always decline to capture, so the static eval (stand pat) is a
+# floor on its score. Checks aren't searched, and being in check doesn't stop
+# the side to move from standing pat. Scores and the window are white
+# relative, as in calc_best_move.
+@profile
+def quiesce(b: chess.Board,
+            current_eval: float,
+            game_phase: float,
+            white_can_get: int,
+            black_can_get: int,
+            clock: SearchClock) -> int:
+    clock.check()
+    clock.positions_explored += 1
+    stand_pat = round(current_eval)
+    white_to_move = b.turn == chess.WHITE
+    if white_to_move:
+        if stand_pat >= black_can_get:
+            return stand_pat
+        white_can_get = max(white_can_get, stand_pat)
+    else:
+        if stand_pat <= white_can_get:
+            return stand_pat
+        black_can_get = min(black_can_get, stand_pat)
+
+    best_score = stand_pat
+    for move, gain in ordered_captures(b):
+        # delta pruning: captures come in falling gain order, so once one
+        # can't reach the window, none of the rest can
+        if white_to_move:
+            if stand_pat + gain + delta_margin <= white_can_get:
+                break
+        else:
+            if stand_pat - gain - delta_margin >= black_can_get:
+                break
+        eval_diff, game_phase_diff = piece_vals_diff(b, move, game_phase)
+        b.push(move)
+        score = quiesce(b,
+                        current_eval + eval_diff,
+                        game_phase + game_phase_diff,
+                        white_can_get,
+                        black_can_get,
+                        clock)
+        b.pop()
+        if white_to_move:
+            if score > best_score:
+                best_score = score
+                if score > white_can_get:
+                    white_can_get = score
+        else:
+            if score < best_score:
+                best_score = score
+                if score < black_can_get:
+                    black_can_get = score
+        if white_can_get >= black_can_get:
+            break
+    return best_score
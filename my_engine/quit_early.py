@@ -1,7 +1,7 @@
 import chess
 from typing import Tuple
 import math
-from line_profiler import profile
+from my_engine.instrument import profile
 
 standard_piece_vals = {chess.PAWN:1, chess.KNIGHT:3, chess.BISHOP:3, 
                        chess.ROOK:5, chess.QUEEN:9, chess.KING:0}
@@ -1,12 +1,23 @@
 import chess
 from my_engine.search_order import SearchOrder
+from my_engine.move_record import MoveRecord
 
 class RandomOrder(SearchOrder):
     def __init__(self):
         pass
     
-    def update_priors(self, sorted_moves : list[chess.Move]) -> None:
+    def update_priors(self, 
+                      b : chess.Board,
+                      ordered_moves : list[MoveRecord], 
+                      explored_count : int, 
+                      best_idx : int,
+                      distance_from_root : int,
+                      move_depth : int,
+                      scores : list[int]) -> None:
         pass
     
-    def order_moves(self, b:chess.Board) -> list[chess.Move]:
-        return [move for move in b.legal_moves]
\ No newline at end of file
+    def order_moves(self, 
+                    b:chess.Board, 
+                    moves : list[MoveRecord], 
+                    distance_from_root : int) -> list[MoveRecord]:
+        return moves
\ No newline at end of file
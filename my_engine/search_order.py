@@ -1,12 +1,33 @@
 import chess
 from abc import ABC, abstractmethod
+from my_engine.move_record import MoveRecord
 
 class SearchOrder(ABC):
 
+    # Called before each search when the priors are kept from one move of a
+    # game to the next.
+    def new_search(self) -> None:
+        pass
+
+    # [ordered_moves] is the list order_moves returned for [b] (possibly with
+    # the hash move brought to the front); the first [explored_count] of them
+    # were searched, with the white relative [scores], and the one at
+    # [best_idx] came out best. [move_depth] is the node's budget.
     @abstractmethod
-    def update_priors(self, sorted_moves : list[chess.Move]) -> None:
+    def update_priors(self, 
+                      b : chess.Board,
+                      ordered_moves : list[MoveRecord], 
+                      explored_count : int, 
+                      best_idx : int,
+                      distance_from_root : int,
+                      move_depth : int,
+                      scores : list[int]) -> None:
         pass
     
+    # [moves] are [b]'s legal moves. Returns them in the order to search them.
     @abstractmethod
-    def order_moves(self, b:chess.Board) -> list[chess.Move]:
-        pass
\ No newline at end of file
+    def order_moves(self, 
+                    b:chess.Board, 
+                    moves : list[MoveRecord], 
+                    distance_from_root : int) -> list[MoveRecord]:
+        pass
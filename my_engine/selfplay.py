@@ -0,0 +1,87 @@
+# Measures what keeping a GameSession between moves buys: plays whole games
+# against itself with a session for each side, as two UCI engines would have,
+# and searches every position of those games a second time from cold,
+# reporting how long each iteration took to finish either way.
+import chess
+import time
+from collections import defaultdict
+from typing import Optional
+
+from my_engine import engine, parallel
+from my_engine.engine import SearchRes
+from my_engine.session import GameSession
+from my_engine.time_manager import SearchClock
+
+# Seconds from the start of a search to the end of each of its iterations,
+# and the positions it explored.
+def timed_search(b: chess.Board,
+                 depth: int,
+                 threads: int,
+                 ordering: engine.Ordering,
+                 session: Optional[GameSession]) -> tuple[SearchRes, list[float]]:
+    clock = SearchClock()
+    iteration_ends : list[float] = []
+    def on_iteration(iteration: int,
+                     positions_explored: int,
+                     res: SearchRes,
+                     pv: list[chess.Move]) -> None:
+        iteration_ends.append(clock.elapsed())
+    res, _ = parallel.go(b, depth, threads, ordering, clock=clock,
+                         on_iteration=on_iteration, session=session)
+    return res, iteration_ends
+
+def time_to_depth_main(depth: int,
+                       fens: str,
+                       max_plies: int,
+                       threads: int,
+                       ordering: engine.Ordering) -> None:
+    with open(fens, 'r') as f:
+        starts = [line.strip() for line in f if line.strip()]
+
+    # per iteration: seconds summed over positions, and how many reached it
+    seconds : dict[str, dict[int, float]] = {"cold": defaultdict(float), "session": defaultdict(float)}
+    reached : dict[str, dict[int, int]] = {"cold": defaultdict(int), "session": defaultdict(int)}
+    positions = {"cold": 0, "session": 0}
+    searches = 0
+    # searches where the opponent played the reply the side's last principal
+    # variation expected
+    expected_replies = 0
+    start = time.monotonic()
+    for fen in starts:
+        b = chess.Board(fen)
+        sessions = {color: GameSession(ordering=ordering) for color in chess.COLORS}
+        try:
+            while b.ply() < max_plies and not b.is_game_over(claim_draw=True):
+                session = sessions[b.turn]
+                expected = session.expected_move(b) is not None
+                cold_res, cold_ends = timed_search(b, depth, threads, ordering, None)
+                res, ends = timed_search(b, depth, threads, ordering, session)
+                # forced moves are played without an iteration, so there is
+                # nothing to time
+                if cold_ends and ends:
+                    for mode, mode_res, mode_ends in (("cold", cold_res, cold_ends),
+                                                      ("session", res, ends)):
+                        positions[mode] += mode_res.positions_explored
+                        for iteration, end in enumerate(mode_ends, 1):
+                            seconds[mode][iteration] += end
+                            reached[mode][iteration] += 1
+                    searches += 1
+                    expected_replies += expected
+                b.push(engine.best_move_of_eval(res.sorted_moves))
+        finally:
+            for session in sessions.values():
+                session.close()
+    parallel.shutdown_pools()
+
+    print(f"{len(starts)} games, {searches} positions, "
+          f"{time.monotonic() - start:.1f}s")
+    print(f"positions explored: cold {positions['cold']} session {positions['session']}")
+    print(f"expected replies: {expected_replies}/{searches}")
+    # only iterations every search of both kinds finished are comparable
+    print("iteration,cold_seconds,session_seconds,speedup")
+    for iteration in sorted(reached["cold"]):
+        if reached["cold"][iteration] < searches or reached["session"][iteration] < searches:
+            continue
+        cold = seconds["cold"][iteration] / searches
+        warm = seconds["session"][iteration] / searches
+        print(f"{iteration},{cold:.4f},{warm:.4f},{cold / warm if warm else 0:.2f}")
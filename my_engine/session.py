@@ -0,0 +1,75 @@
+# What one game's searches hand on to the next: the transposition table, the
+# move ordering priors and the principal variation. Owned by the UCI loop and
+# only cleared on ucinewgame.
+import chess
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+from my_engine import engine, zobrist
+from my_engine.search_order import SearchOrder
+from my_engine.transposition import TranspositionTable, table_bytes
+
+class GameSession:
+    size_mb: int
+    ordering: engine.Ordering
+    # the table lives in shared memory, so helper processes can search it
+    tt_shm: SharedMemory
+    tt: TranspositionTable
+    search_order: SearchOrder
+    # the last search's principal variation, from its root
+    pv: list[chess.Move]
+    pv_root_key: Optional[int]
+
+    def __init__(self, size_mb: int = engine.default_hash_mb,
+                 ordering: engine.Ordering = engine.Ordering.LINEAR):
+        self.size_mb = size_mb
+        self.ordering = ordering
+        self.open_table()
+        self.search_order = engine.make_search_order(ordering)
+        self.pv = []
+        self.pv_root_key = None
+
+    def open_table(self) -> None:
+        self.tt_shm = SharedMemory(create=True, size=table_bytes(self.size_mb))
+        self.tt = TranspositionTable(self.size_mb, self.tt_shm.buf)
+
+    def close(self) -> None:
+        self.tt.release()
+        self.tt_shm.close()
+        self.tt_shm.unlink()
+
+    def resize(self, size_mb: int) -> None:
+        if size_mb == self.size_mb:
+            return
+        self.close()
+        self.size_mb = size_mb
+        self.open_table()
+
+    def new_game(self) -> None:
+        self.tt.clear()
+        self.search_order = engine.make_search_order(self.ordering)
+        self.pv = []
+        self.pv_root_key = None
+
+    # Called before each search.
+    def new_search(self) -> None:
+        self.tt.new_search()
+        self.search_order.new_search()
+
+    def set_pv(self, b: chess.Board, pv: list[chess.Move]) -> None:
+        self.pv = pv
+        self.pv_root_key = zobrist.board_key(b)
+
+    # If [b] is where the last principal variation expected us to be two
+    # plies on, the move it expected us to play there.
+    def expected_move(self, b: chess.Board) -> Optional[chess.Move]:
+        if len(self.pv) < 3 or len(b.move_stack) < 2 or self.pv_root_key is None:
+            return None
+        if b.move_stack[-2:] != self.pv[:2]:
+            return None
+        b_before = b.copy(stack=2)
+        b_before.pop()
+        b_before.pop()
+        if zobrist.board_key(b_before) != self.pv_root_key:
+            return None
+        return self.pv[2]
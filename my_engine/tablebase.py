@@ -0,0 +1,101 @@
+# Syzygy endgame tablebases, probed by the search once few enough pieces are
+# left.
+import chess
+import chess.syzygy
+import os
+from collections import OrderedDict
+from typing import Optional
+from my_engine.instrument import profile
+
+# how many positions' probe results to remember
+default_cache_entries = 1 << 16
+
+class Tablebases:
+    tables: chess.syzygy.Tablebase
+    # most pieces, kings included, of any table found
+    max_pieces: int
+    # WDL by zobrist key, least recently used first. None for positions whose
+    # table is missing.
+    cache: OrderedDict[int, Optional[int]]
+
+    # [path] is one or more directories, separated as in PATH
+    def __init__(self, path: str, cache_entries: int = default_cache_entries):
+        self.tables = chess.syzygy.Tablebase()
+        for directory in path.split(os.pathsep):
+            if directory:
+                self.tables.add_directory(directory)
+        # table names look like KQvKR
+        self.max_pieces = max((len(name) - 1 for name in self.tables.wdl), default=0)
+        self.cache = OrderedDict()
+        self.cache_entries = cache_entries
+
+    def close(self) -> None:
+        self.tables.close()
+
+    def can_probe(self, b: chess.Board) -> bool:
+        return chess.popcount(b.occupied) <= self.max_pieces and not b.castling_rights
+
+    # From the side to move's point of view: 2 is a win, 1 a win the fifty
+    # move rule turns into a draw, 0 a draw, and -1 and -2 the same for
+    # losses. [key] is [b]'s zobrist key.
+    @profile
+    def probe_wdl(self, b: chess.Board, key: int) -> Optional[int]:
+        cache = self.cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        try:
+            wdl : Optional[int] = self.tables.probe_wdl(b)
+        except KeyError:
+            wdl = None
+        cache[key] = wdl
+        if len(cache) > self.cache_entries:
+            cache.popitem(last=False)
+        return wdl
+
+    # The root moves worth searching, or None if the root can't be probed.
+    # Only moves that keep the best WDL are kept. When that is a win, only
+    # the ones that reach a capture, pawn move or mate soonest (by DTZ) are
+    # kept, since the eval can't tell progress from shuffling. When it is a
+    # loss, only the ones that put it off longest.
+    def root_moves(self, b: chess.Board) -> Optional[list[chess.Move]]:
+        if not self.can_probe(b):
+            return None
+        ranked : list[tuple[chess.Move, int, int]] = []
+        try:
+            for move in b.legal_moves:
+                zeroing = b.is_zeroing(move)
+                b.push(move)
+                try:
+                    wdl = -self.tables.probe_wdl(b)
+                    plies_to_zero = 0 if zeroing or b.is_checkmate() else abs(self.tables.probe_dtz(b))
+                finally:
+                    b.pop()
+                ranked.append((move, wdl, plies_to_zero))
+        except KeyError:
+            return None
+        if not ranked:
+            return None
+
+        best_wdl = max(wdl for _, wdl, _ in ranked)
+        ranked = [entry for entry in ranked if entry[1] == best_wdl]
+        if best_wdl > 0:
+            best_plies = min(plies for _, _, plies in ranked)
+        elif best_wdl < 0:
+            best_plies = max(plies for _, _, plies in ranked)
+        else:
+            return [move for move, _, _ in ranked]
+        return [move for move, _, plies in ranked if plies == best_plies]
+
+# tables are opened once per process and kept around between searches
+opened : dict[str, Tablebases] = {}
+
+def open_tablebases(path: str) -> Tablebases:
+    if path not in opened:
+        opened[path] = Tablebases(path)
+    return opened[path]
+
+def close_tablebases() -> None:
+    for tablebases in opened.values():
+        tablebases.close()
+    opened.clear()
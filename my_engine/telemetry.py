@@ -0,0 +1,196 @@
+# What a search counts as it goes, and the JSON record made from it once
+# the search is over. Counting is plain int increments; anything derived
+# (rates, branching factors, histograms) is worked out in report.
+import json
+from typing import Any, Optional
+
+from my_engine.instrument import Snapshot
+
+Record = dict[str, Any]
+
+# cutoffs are bucketed by the index of the move that caused them, with the
+# last bucket taking every index from it on
+cutoff_buckets = 8
+
+class Stats:
+    # per distance from the root: nodes whose moves were searched, their
+    # legal moves, and the moves actually searched before a cutoff or the end
+    explorations_at_depth: list[int]
+    moves_at_depth: list[int]
+    opt_moves_at_depth: list[int]
+    # per distance from the root, [cutoff_buckets] counts of the index of
+    # the move that caused a cutoff
+    cutoffs: list[int]
+
+    # extensions taken, and the positions explored under first extensions
+    extensions: int
+    moves_post_extensions: int
+    # transposition table probes, those that found an entry for the
+    # position, and those whose entry ended the node
+    tt_probes: int
+    tt_hits: int
+    tt_cutoffs: int
+    # null window searches of moves after the first, and how many of those
+    # had to be searched again with the full window
+    scouts: int
+    scout_re_searches: int
+    # root searches repeated because the score fell outside the aspiration
+    # window
+    aspiration_re_searches: int
+    # null move searches tried and how many cut the node off
+    null_moves: int
+    null_move_cutoffs: int
+    # moves searched with reduced budget and how many of those were searched
+    # again with their full share
+    reductions: int
+    reduction_re_searches: int
+    # positions scored by the endgame tablebases
+    tablebase_hits: int
+    # (move_depth, positions it explored, seconds since the start of the
+    # search) for each finished iteration
+    iterations: list[tuple[int, int, float]]
+
+    def __init__(self, initial_eval: float, depths: int):
+        self.explorations_at_depth = [0] * depths
+        self.moves_at_depth = [0] * depths
+        self.opt_moves_at_depth = [0] * depths
+        self.cutoffs = [0] * (depths * cutoff_buckets)
+        self.extensions = 0
+        self.moves_post_extensions = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.scouts = 0
+        self.scout_re_searches = 0
+        self.aspiration_re_searches = 0
+        self.null_moves = 0
+        self.null_move_cutoffs = 0
+        self.reductions = 0
+        self.reduction_re_searches = 0
+        self.tablebase_hits = 0
+        self.iterations = []
+        self.initial_eval = initial_eval
+
+    def depths_reached(self) -> int:
+        return max([depth + 1 for depth, e in enumerate(self.explorations_at_depth) if e > 0],
+                   default=0)
+
+    # The flat counters, with the per depth ones cut off after the deepest
+    # explored depth.
+    def counters(self) -> dict[str, Any]:
+        depths = self.depths_reached()
+        return {"moves_at_depth": self.moves_at_depth[:depths],
+                "opt_moves_at_depth": self.opt_moves_at_depth[:depths],
+                "explorations_at_depth": self.explorations_at_depth[:depths],
+                "extensions": self.extensions,
+                "moves_post_extensions": self.moves_post_extensions,
+                "tt_probes": self.tt_probes,
+                "tt_hits": self.tt_hits,
+                "tt_cutoffs": self.tt_cutoffs,
+                "scouts": self.scouts,
+                "scout_re_searches": self.scout_re_searches,
+                "aspiration_re_searches": self.aspiration_re_searches,
+                "null_moves": self.null_moves,
+                "null_move_cutoffs": self.null_move_cutoffs,
+                "reductions": self.reductions,
+                "reduction_re_searches": self.reduction_re_searches,
+                "tablebase_hits": self.tablebase_hits}
+
+    def ply_records(self) -> list[Record]:
+        nodes = self.explorations_at_depth
+        plies = []
+        for depth in range(self.depths_reached()):
+            cutoffs = self.cutoffs[depth * cutoff_buckets:(depth + 1) * cutoff_buckets]
+            next_nodes = nodes[depth + 1] if depth + 1 < len(nodes) else 0
+            plies.append({"ply": depth,
+                          "nodes": nodes[depth],
+                          "avg_moves": ratio(self.moves_at_depth[depth], nodes[depth]),
+                          "avg_searched": ratio(self.opt_moves_at_depth[depth], nodes[depth]),
+                          # nodes searched one ply further on, per node here
+                          "branching": ratio(next_nodes, nodes[depth]),
+                          "cutoff_rate": ratio(sum(cutoffs), nodes[depth]),
+                          "cutoff_index": cutoffs})
+        return plies
+
+    # [positions_explored] and [seconds] are for the whole search, so they
+    # can include helper processes. [profile] is what instrumentation counted
+    # during the search, if it was on.
+    def report(self,
+               positions_explored: int,
+               seconds: float,
+               profile: Optional[Snapshot] = None) -> Record:
+        cutoff_index = [sum(self.cutoffs[bucket::cutoff_buckets])
+                        for bucket in range(cutoff_buckets)]
+        # positions each iteration explored over the one before, i.e. the cost
+        # of its bigger budget
+        iteration_growth = [ratio(positions, last_positions)
+                            for (_, last_positions, _), (_, positions, _)
+                            in zip(self.iterations, self.iterations[1:])]
+        return {"positions_explored": positions_explored,
+                "seconds": seconds,
+                "nps": ratio(positions_explored, seconds),
+                "initial_eval": self.initial_eval,
+                "plies": self.ply_records(),
+                "cutoff_index": cutoff_index,
+                "first_move_cutoff_rate": ratio(cutoff_index[0], sum(cutoff_index)),
+                "extensions": {"taken": self.extensions,
+                               "positions_after": self.moves_post_extensions},
+                "tt": {"probes": self.tt_probes,
+                       "hits": self.tt_hits,
+                       "cutoffs": self.tt_cutoffs,
+                       "hit_rate": ratio(self.tt_hits, self.tt_probes),
+                       "cutoff_rate": ratio(self.tt_cutoffs, self.tt_probes)},
+                "scouts": {"searched": self.scouts,
+                           "re_searched": self.scout_re_searches},
+                "aspiration_re_searches": self.aspiration_re_searches,
+                "null_moves": {"searched": self.null_moves,
+                               "cutoffs": self.null_move_cutoffs},
+                "reductions": {"searched": self.reductions,
+                               "re_searched": self.reduction_re_searches},
+                "tablebase_hits": self.tablebase_hits,
+                "iterations": [{"move_depth": move_depth,
+                                "positions_explored": positions,
+                                "seconds": iteration_seconds}
+                               for move_depth, positions, iteration_seconds in self.iterations],
+                "iteration_growth": iteration_growth,
+                "time": time_split(profile, seconds) if profile else None}
+
+def ratio(a: float, b: float) -> float:
+    return a / b if b else 0.
+
+# Instrumented functions by what they spend time on, counting only the
+# outermost ones of each kind (eval_piece_vals calls game_phase, and its
+# time already includes that; the diffs read the flat tables directly).
+# Everything else in a search counts as search.
+time_categories = {"move_generation": ["my_engine.move_record.legal_moves",
+                                       "my_engine.quiescence.ordered_captures"],
+                   "eval": ["my_engine.eval_piece_vals.eval_piece_vals",
+                            "my_engine.eval_piece_vals.diff",
+                            "my_engine.eval_piece_vals.record_diff",
+                            "my_engine.eval_piece_vals.diffs"],
+                   "transposition": ["my_engine.transposition.TranspositionTable.probe",
+                                     "my_engine.transposition.TranspositionTable.store"]}
+# search orders are told apart by their method names
+ordering_methods = [".order_moves", ".update_priors"]
+
+def time_category(name: str) -> Optional[str]:
+    for category, names in time_categories.items():
+        if name in names:
+            return category
+    if any(name.endswith(method) for method in ordering_methods):
+        return "ordering"
+    return None
+
+def time_split(profile: Snapshot, seconds: float) -> Record:
+    split = {category: 0. for category in [*time_categories, "ordering"]}
+    for name, counts in profile.items():
+        category = time_category(name)
+        if category is not None:
+            split[category] += counts["seconds"]
+    split["search"] = max(seconds - sum(split.values()), 0.)
+    return split
+
+# Telemetry goes out as JSON lines, one search per line.
+def append(path: str, record: Record) -> None:
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
@@ -0,0 +1,154 @@
+import chess
+import threading
+import time
+from typing import Callable, Optional
+from my_engine.instrument import profile
+
+# how many nodes we search between looking at the clock. A node generates
+# its legal moves, which takes far longer than reading the clock, and in busy
+# middlegames 256 of them took over 100ms.
+nodes_per_clock_check = 16
+
+# least number of seconds between two progress reports
+progress_interval = 1.
+
+# when the GUI doesn't send movestogo, assume the game lasts this many more
+# of our moves
+default_moves_to_go = 30
+
+class SearchAborted(Exception):
+    pass
+
+class SearchClock:
+    start: float
+    # past the soft limit we don't start another iteration, past the hard
+    # limit we abandon the iteration we're in. Both are in seconds from start.
+    soft_limit: Optional[float]
+    hard_limit: Optional[float]
+
+    # counted by the search as it goes, so progress can be reported before an
+    # iteration finishes
+    positions_explored: int
+    on_progress: Optional[Callable[[], None]]
+    # polled along with the time, for stop requests that come from outside
+    # the process
+    should_stop: Optional[Callable[[], bool]]
+    # While pondering the limits don't apply, and once they do they count
+    # from ponderhit, [limit_start] seconds from start.
+    pondering: bool
+    limit_start: float
+    ponder_over: threading.Event
+
+    def __init__(self, 
+                 soft_limit: Optional[float] = None, 
+                 hard_limit: Optional[float] = None,
+                 pondering: bool = False):
+        self.start = time.monotonic()
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.pondering = pondering
+        self.limit_start = 0.
+        self.ponder_over = threading.Event()
+        self.nodes_until_check = nodes_per_clock_check
+        self.stopped = False
+        self.positions_explored = 0
+        self.on_progress = None
+        self.should_stop = None
+        self.next_progress = progress_interval
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    # Asks the search using this clock to give up at its next node. Safe to
+    # call from another thread.
+    def stop(self) -> None:
+        self.stopped = True
+        self.ponder_over.set()
+
+    # The opponent played the move we pondered on, so the search is now on
+    # our clock. Safe to call from another thread.
+    def ponderhit(self) -> None:
+        self.limit_start = self.elapsed()
+        self.pondering = False
+        self.ponder_over.set()
+
+    # A ponder search can't answer before ponderhit or stop, even if it
+    # finished.
+    def wait_while_pondering(self) -> None:
+        if self.pondering:
+            self.ponder_over.wait()
+
+    def limit_elapsed(self) -> Optional[float]:
+        if self.pondering:
+            return None
+        return self.elapsed() - self.limit_start
+
+    @profile
+    def check(self) -> None:
+        if self.stopped:
+            raise SearchAborted()
+        self.nodes_until_check -= 1
+        if self.nodes_until_check > 0:
+            return
+        self.nodes_until_check = nodes_per_clock_check
+        if self.should_stop is not None and self.should_stop():
+            raise SearchAborted()
+        if self.hard_limit is None and self.on_progress is None:
+            return
+        if self.hard_limit is not None:
+            limit_elapsed = self.limit_elapsed()
+            if limit_elapsed is not None and limit_elapsed > self.hard_limit:
+                raise SearchAborted()
+        if self.on_progress is None:
+            return
+        elapsed = self.elapsed()
+        if elapsed >= self.next_progress:
+            self.next_progress = elapsed + progress_interval
+            self.on_progress()
+
+    # [last_iteration] is how long the iteration that just finished took, and
+    # [growth] how much bigger the next one's budget is.
+    def can_start_iteration(self, last_iteration: float, growth: int) -> bool:
+        if self.stopped or (self.should_stop is not None and self.should_stop()):
+            return False
+        elapsed = self.limit_elapsed()
+        if elapsed is None:
+            return True
+        if self.soft_limit is not None and elapsed > self.soft_limit:
+            return False
+        if self.hard_limit is not None and elapsed + last_iteration * growth > self.hard_limit:
+            return False
+        return True
+
+# A go ponder is given the limits of the move it ponders on, for after
+# ponderhit.
+def allocate(fields: dict[str, str], turn: chess.Color, move_overhead_ms: int) -> SearchClock:
+    soft_limit, hard_limit = time_limits(fields, turn, move_overhead_ms)
+    return SearchClock(soft_limit, hard_limit, "ponder" in fields)
+
+# (soft limit, hard limit) in seconds
+def time_limits(fields: dict[str, str], 
+                turn: chess.Color, 
+                move_overhead_ms: int) -> tuple[Optional[float], Optional[float]]:
+    if "infinite" in fields:
+        return None, None
+
+    if "movetime" in fields:
+        movetime = max(int(fields["movetime"]) - move_overhead_ms, 1) / 1000
+        return movetime, movetime
+
+    time_field, inc_field = ("wtime", "winc") if turn == chess.WHITE else ("btime", "binc")
+    if time_field not in fields:
+        return None, None
+
+    time_left = max(int(fields[time_field]) - move_overhead_ms, 1) / 1000
+    inc = int(fields.get(inc_field, "0")) / 1000
+    moves_to_go = int(fields.get("movestogo", default_moves_to_go))
+    moves_to_go = max(min(moves_to_go, default_moves_to_go), 1)
+
+    # aim to spend an even share of the clock plus most of the increment, but
+    # let a hard iteration run on to a few times that share
+    target = time_left / moves_to_go + inc * 0.75
+    hard_limit = min(target * 4, time_left * 0.6)
+    soft_limit = min(target, hard_limit)
+    return soft_limit, hard_limit
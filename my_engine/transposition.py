@@ -0,0 +1,114 @@
+import chess
+from enum import IntEnum
+from typing import Optional, Tuple
+from my_engine.instrument import profile
+
+# Each slot is three 64 bit words: a check word, a packed meta word and the
+# score. The check word is key ^ meta ^ score, so a slot only matches its own
+# key when all three words were written together.
+slot_bytes = 24
+mask_64 = (1 << 64) - 1
+
+class Bound(IntEnum):
+    # the stored score is the value of the position
+    EXACT = 0
+    # the value of the position is at least the stored score
+    LOWER = 1
+    # the value of the position is at most the stored score
+    UPPER = 2
+
+# (score, move_depth, ply_depth, bound, best move)
+Entry = Tuple[int, int, int, Bound, Optional[chess.Move]]
+
+def pack_move(move: Optional[chess.Move]) -> int:
+    if move is None:
+        return 0
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+def unpack_move(packed: int) -> Optional[chess.Move]:
+    if packed == 0:
+        return None
+    return chess.Move(packed & 63, (packed >> 6) & 63, (packed >> 12) or None)
+
+def table_slots(size_mb: int) -> int:
+    slots = 1
+    while slots * 2 * slot_bytes <= max(size_mb, 1) * 1024 * 1024:
+        slots *= 2
+    return slots
+
+def table_bytes(size_mb: int) -> int:
+    return table_slots(size_mb) * slot_bytes
+
+class TranspositionTable:
+    slots: int
+    generation: int
+
+    # [buf] lets several processes share one table, e.g. through
+    # multiprocessing.shared_memory. It needs at least table_bytes(size_mb)
+    # bytes, which must start out zeroed.
+    def __init__(self, size_mb: int, buf: Optional[memoryview] = None):
+        slots = table_slots(size_mb)
+        self.slots = slots
+        self.mask = slots - 1
+        self.generation = 0
+        if buf is None:
+            self.buf = memoryview(bytearray(slots * slot_bytes))
+        else:
+            self.buf = buf[:slots * slot_bytes]
+        self.checks = self.buf[:slots * 8].cast("Q")
+        self.metas = self.buf[slots * 8:slots * 16].cast("Q")
+        self.scores = self.buf[slots * 16:].cast("q")
+
+    # The owner of the table calls this before each search, so entries from
+    # older searches get replaced before entries from the current one.
+    def new_search(self) -> None:
+        self.generation = (self.generation + 1) & 63
+
+    def clear(self) -> None:
+        self.buf[:] = bytes(len(self.buf))
+        self.generation = 0
+
+    # Needed before a shared buffer can be closed.
+    def release(self) -> None:
+        self.checks.release()
+        self.metas.release()
+        self.scores.release()
+        self.buf.release()
+
+    @profile
+    def probe(self, key: int) -> Optional[Entry]:
+        idx = key & self.mask
+        meta = self.metas[idx]
+        score = self.scores[idx]
+        if meta == 0 or self.checks[idx] != key ^ meta ^ (score & mask_64):
+            return None
+        return (score,
+                meta >> 32,
+                (meta >> 24) & 255,
+                Bound((meta >> 16) & 3),
+                unpack_move(meta & 0xffff))
+
+    # Depth preferred replacement, except that entries left over from older
+    # searches are always replaced.
+    @profile
+    def store(self,
+              key: int,
+              score: int,
+              move_depth: int,
+              ply_depth: int,
+              bound: Bound,
+              move: Optional[chess.Move]) -> None:
+        idx = key & self.mask
+        old_meta = self.metas[idx]
+        if old_meta != 0 and ((old_meta >> 18) & 63) == self.generation \
+            and (old_meta >> 32) > move_depth \
+            and self.checks[idx] != key ^ old_meta ^ (self.scores[idx] & mask_64):
+            return
+        meta = (min(move_depth, 0xffffffff) << 32) \
+            | (min(ply_depth, 255) << 24) \
+            | (self.generation << 18) \
+            | (int(bound) << 16) \
+            | pack_move(move)
+        self.metas[idx] = meta
+        self.scores[idx] = score
+        self.checks[idx] = key ^ meta ^ (score & mask_64)
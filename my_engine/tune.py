@@ -0,0 +1,220 @@
+# Texel tuning of the piece values and square tables in eval_piece_vals:
+# fits them so that a sigmoid of the eval predicts labelled positions' game
+# results (or engine scores), by gradient descent over the whole set at once.
+# The positions should be quiet, e.g. the output of gen_stable_positions.
+import chess
+import math
+import re
+import time
+import numpy as np
+from typing import Optional
+
+from my_engine import batch_eval
+from my_engine import eval_piece_vals
+
+# Features are folded over color: column piece_type * 64 + table square is +1
+# for a white piece there and -1 for a black piece on the mirrored square,
+# so both colors share one value per (piece type, table square), as in the
+# tables. Table squares run from a8 to h1, from white's side.
+tuned_count = 6 * 64
+# rows converted to float32 and multiplied at a time
+chunk_rows = 1 << 12
+
+piece_names = {chess.PAWN: "pawn", chess.KNIGHT: "knight", chess.BISHOP: "bishop",
+               chess.ROOK: "rook", chess.QUEEN: "queen", chess.KING: "king"}
+
+result_labels = {"1-0": 1., "0-1": 0., "1/2-1/2": .5}
+
+# A label is a game result from white's side (1-0, 0-1, 1/2-1/2, or 1, 0,
+# 0.5) or an engine score in centipawns from white's side. Lines are a FEN
+# then ';' or ',' and the label, or EPD with the result in a c9 opcode.
+def parse_line(line: str) -> tuple[str, str]:
+    if (c9 := re.search(r'c9 "([^"]*)"', line)) is not None:
+        return line[:c9.start()].strip(), c9.group(1)
+    split_at = max(line.rfind(";"), line.rfind(","))
+    return line[:split_at].strip(), line[split_at + 1:].strip()
+
+def load(path: str, scores: bool) -> tuple[list[str], np.ndarray]:
+    fens, labels = [], []
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            fen, label = parse_line(line)
+            fens.append(fen)
+            if scores:
+                # as the probability of winning that the score stands for
+                labels.append(1. / (1. + 10. ** (-float(label) / 400.)))
+            else:
+                labels.append(result_labels[label] if label in result_labels else float(label))
+    return fens, np.array(labels, dtype=np.float64)
+
+# (features, phases): the folded features as int8, and each position's
+# game phase, which is kept as it is.
+def features(fens: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    folded = np.zeros((len(fens), tuned_count), dtype=np.int8)
+    phases = np.zeros(len(fens), dtype=np.float64)
+    for start in range(0, len(fens), batch_eval.batch_rows):
+        end = start + batch_eval.batch_rows
+        squares = batch_eval.fen_squares(fens[start:end])
+        _, _, phases[start:end] = batch_eval.scores(batch_eval.square_features(squares))
+        # white pieces are at piece_index piece_type - 1, black at + 6
+        rows, square_idx = np.nonzero((squares >= 0) & (squares < 6))
+        folded[start + rows, squares[rows, square_idx] * 64 + (square_idx ^ 56)] = 1
+        rows, square_idx = np.nonzero(squares >= 6)
+        folded[start + rows, (squares[rows, square_idx] - 6) * 64 + square_idx] -= 1
+    return folded, phases
+
+# (tuned_count, 2) mg and eg values, base value included, from the tables.
+def initial_params() -> np.ndarray:
+    params = np.zeros((tuned_count, 2), dtype=np.float64)
+    for piece_type in chess.PIECE_TYPES:
+        for table_square in chess.SQUARES:
+            idx = (piece_type - 1) * 64 + table_square
+            params[idx, 0] = eval_piece_vals.mg_base_value[piece_type] + \
+                eval_piece_vals.mg_tables[piece_type][table_square]
+            params[idx, 1] = eval_piece_vals.eg_base_value[piece_type] + \
+                eval_piece_vals.eg_tables[piece_type][table_square]
+    return params
+
+def evals(folded: np.ndarray, phases: np.ndarray, params: np.ndarray) -> np.ndarray:
+    weights = params.astype(np.float32)
+    sums = np.empty((len(folded), 2), dtype=np.float64)
+    for start in range(0, len(folded), chunk_rows):
+        sums[start:start + chunk_rows] = folded[start:start + chunk_rows].astype(np.float32) @ weights
+    return phases * sums[:, 0] + (1. - phases) * sums[:, 1]
+
+def win_probability(evals: np.ndarray, k: float) -> np.ndarray:
+    return 1. / (1. + np.exp(-k * math.log(10.) / 400. * evals))
+
+def loss(evals: np.ndarray, labels: np.ndarray, k: float) -> float:
+    return float(np.mean((win_probability(evals, k) - labels) ** 2))
+
+# The sigmoid's scale that best fits the untuned eval, by golden section
+# search, so tuning changes the values rather than their scale.
+def fit_k(evals: np.ndarray, labels: np.ndarray, low: float = .1, high: float = 4.) -> float:
+    ratio = (math.sqrt(5.) - 1.) / 2.
+    for _ in range(40):
+        a, b = high - ratio * (high - low), low + ratio * (high - low)
+        if loss(evals, labels, a) < loss(evals, labels, b):
+            high = b
+        else:
+            low = a
+    return (low + high) / 2.
+
+# The loss and its gradient with respect to params, in one pass over the
+# features a chunk at a time, so each chunk is converted to float once and
+# while it is still in cache.
+def loss_and_gradient(folded: np.ndarray,
+                      phases: np.ndarray,
+                      labels: np.ndarray,
+                      params: np.ndarray,
+                      k: float) -> tuple[float, np.ndarray]:
+    scale = k * math.log(10.) / 400.
+    weights = params.astype(np.float32)
+    total_loss = 0.
+    grad = np.zeros((tuned_count, 2), dtype=np.float64)
+    for start in range(0, len(folded), chunk_rows):
+        end = start + chunk_rows
+        chunk = folded[start:end].astype(np.float32)
+        chunk_phases = phases[start:end]
+        sums = (chunk @ weights).astype(np.float64)
+        chunk_evals = chunk_phases * sums[:, 0] + (1. - chunk_phases) * sums[:, 1]
+        probability = win_probability(chunk_evals, k)
+        error = probability - labels[start:end]
+        total_loss += float(np.dot(error, error))
+        d_eval = 2. * error * probability * (1. - probability) * scale
+        d_sums = np.stack([d_eval * chunk_phases, d_eval * (1. - chunk_phases)], axis=1)
+        grad += chunk.T @ d_sums.astype(np.float32)
+    return total_loss / len(labels), grad / len(labels)
+
+# Adam over the whole set, reporting the loss every [report_every] epochs.
+def fit(folded: np.ndarray,
+        phases: np.ndarray,
+        labels: np.ndarray,
+        params: np.ndarray,
+        k: float,
+        epochs: int,
+        learning_rate: float,
+        report_every: int = 50) -> np.ndarray:
+    beta1, beta2, epsilon = .9, .999, 1e-8
+    first = np.zeros_like(params)
+    second = np.zeros_like(params)
+    start = time.monotonic()
+    for epoch in range(1, epochs + 1):
+        epoch_loss, grad = loss_and_gradient(folded, phases, labels, params, k)
+        if epoch == 1 or epoch % report_every == 0:
+            print(f"epoch {epoch}: loss {epoch_loss:.6f} "
+                  f"({time.monotonic() - start:.0f}s)", flush=True)
+        first = beta1 * first + (1. - beta1) * grad
+        second = beta2 * second + (1. - beta2) * grad * grad
+        first_hat = first / (1. - beta1 ** epoch)
+        second_hat = second / (1. - beta2 ** epoch)
+        params = params - learning_rate * first_hat / (np.sqrt(second_hat) + epsilon)
+    return params
+
+# Splits fitted values back into a base value and a table, with the base
+# the mean over the squares the piece can stand on (kings keep a base of 0,
+# as in PeSTO) and pawns' first and last rank left at 0.
+def base_and_table(values: np.ndarray, piece_type: chess.PieceType) -> tuple[int, list[int]]:
+    squares = list(range(8, 56)) if piece_type == chess.PAWN else list(range(64))
+    base = 0 if piece_type == chess.KING else int(round(float(values[squares].mean())))
+    table = [0] * 64
+    for square in squares:
+        table[square] = int(round(float(values[square]))) - base
+    return base, table
+
+def format_table(name: str, table: list[int]) -> str:
+    rows = [" ".join(f"{value:4d}," for value in table[rank * 8:rank * 8 + 8])
+            for rank in range(8)]
+    return f"{name}= [\n" + "\n".join(f"    {row}" for row in rows) + "\n]\n"
+
+def table_module(params: np.ndarray, source: str) -> str:
+    bases : dict[str, dict[chess.PieceType, int]] = {"mg": {}, "eg": {}}
+    tables = []
+    for piece_type in chess.PIECE_TYPES:
+        for phase_idx, phase in enumerate(["mg", "eg"]):
+            values = params[(piece_type - 1) * 64:piece_type * 64, phase_idx]
+            base, table = base_and_table(values, piece_type)
+            bases[phase][piece_type] = base
+            tables.append(format_table(f"{phase}_{piece_names[piece_type]}_table", table))
+    lines = [f"# Tuned by main.py tune from {source}. Same names and layout as the",
+             "# tables in eval_piece_vals.",
+             "import chess",
+             ""]
+    for phase in ["mg", "eg"]:
+        base_values = ", ".join(f"chess.{piece_names[piece_type].upper()}:{bases[phase][piece_type]}"
+                                for piece_type in chess.PIECE_TYPES)
+        lines.append(f"{phase}_base_value : dict[chess.PieceType, int] = {{ {base_values} }}")
+    lines.append("")
+    lines.extend(tables)
+    for phase in ["mg", "eg"]:
+        entries = "\n".join(f"    chess.{piece_names[piece_type].upper()}:"
+                            f"{phase}_{piece_names[piece_type]}_table,"
+                            for piece_type in chess.PIECE_TYPES)
+        lines.append(f"{phase}_tables = {{\n{entries}\n}}\n")
+    return "\n".join(lines)
+
+def main(positions: str,
+         out: str,
+         scores: bool,
+         epochs: int,
+         learning_rate: float,
+         k: Optional[float]) -> None:
+    start = time.monotonic()
+    fens, labels = load(positions, scores)
+    folded, phases = features(fens)
+    del fens
+    print(f"{len(labels)} positions, {folded.nbytes / 1e6:.0f}MB of features "
+          f"({time.monotonic() - start:.0f}s)", flush=True)
+
+    params = initial_params()
+    if k is None:
+        k = fit_k(evals(folded, phases, params), labels)
+        print(f"k = {k:.4f}", flush=True)
+    params = fit(folded, phases, labels, params, k, epochs, learning_rate)
+    print(f"final loss {loss(evals(folded, phases, params), labels, k):.6f} "
+          f"({time.monotonic() - start:.0f}s)")
+    with open(out, "w") as f:
+        f.write(table_module(params, positions))
+    print(f"wrote {out}")
@@ -1,8 +1,16 @@
 # Implements the UCI protocol (at least enough of it to play on lichess)
 import sys
+import threading
 import chess
 from my_engine import engine
-from typing import Optional
+from my_engine import time_manager
+from my_engine import parallel
+from my_engine import book
+from my_engine import tablebase
+from my_engine import instrument
+from my_engine import telemetry
+from my_engine.session import GameSession
+from typing import Optional, TextIO
 
 
 class Response():
@@ -17,6 +25,9 @@ class Option():
         self.name = name
         self.type = type
         self.rest = rest
+        # the value starts out as the default, and is changed by setoption
+        rest_terms = rest.split()
+        self.value = rest_terms[rest_terms.index("default") + 1]
         
     def __str__(self):
         return f"option name {self.name} type {self.type} {self.rest}"
@@ -24,8 +35,47 @@ class Option():
     
 
 options = [Option("Move Overhead", "spin", "default 0"), 
-           Option("Threads", "spin", "default 1"),
-           Option("Hash", "spin", "default 1")]
+           Option("Threads", "spin", "default 1 min 1 max 64"),
+           Option("Hash", "spin", f"default {engine.default_hash_mb} min 1 max 4096"),
+           # only tells the GUI we can ponder; it decides when to send go ponder
+           Option("Ponder", "check", "default false"),
+           Option("NullMove", "check", "default false"),
+           Option("LateMoveReductions", "check", "default false"),
+           Option("BookFile", "string", "default <empty>"),
+           Option("BookDepth", "spin", "default 20 min 0 max 200"),
+           Option("SyzygyPath", "string", "default <empty>"),
+           # call counts and timings are written here after each search, when
+           # the engine was started with MY_ENGINE_INSTRUMENT=1
+           Option("ProfileFile", "string", "default <empty>"),
+           # one JSON line of telemetry is appended here after each search
+           Option("TelemetryFile", "string", "default <empty>")]
+
+def option_flag(name:str) -> bool:
+    return option_value(name).lower() == "true"
+
+# None for string options left empty
+def option_path(name:str) -> Optional[str]:
+    value = option_value(name)
+    if value in ["", "<empty>"]:
+        return None
+    return value
+
+def option_value(name:str) -> str:
+    for option in options:
+        if option.name.lower() == name.lower():
+            return option.value
+    raise ValueError(name)
+
+def setoption_response(input:list[str], b:chess.Board) -> Response:
+    # setoption name <name> [value <value>], where the name can contain spaces
+    value_idx = input.index("value") if "value" in input else len(input)
+    name = " ".join(input[2:value_idx])
+    value = " ".join(input[value_idx + 1:])
+    for option in options:
+        if option.name.lower() == name.lower():
+            option.value = value
+            return Response(False, [], b, f"set {option.name} to {value}")
+    return Response(False, [], b, f"unknown option {name}")
 
 def parse_go(input:list[str]) -> dict[str,str]:
     idx = 0
@@ -69,51 +119,270 @@ def position_response(input: list[str]) -> Response:
     return Response(False, [], b, None)
     
     
-def go_response(fields : dict[str, str], b:chess.Board) -> Response:
-    depth = 800000
-    if "movetime" in fields:
-        movetime = max(10000, int(fields["movetime"]))
-        depth = int(movetime * 0.7)
-    res, _ = engine.go(b, depth)
-
-    log = f"explored: {res.positions_explored}"
-    best_move = engine.best_move_of_eval(res.sorted_moves)
-    return Response(False, [f"bestmove {chess.Move.uci(best_move)}"], chess.Board(), log)
-
-def dynamic_response(input:list[str], b:chess.Board) -> Response:
+# move_depth for searches that only stop on the clock or on stop
+max_depth = 1_000_000_000
+# move_depth for a go with neither a clock nor a depth
+default_depth = 800_000
+
+# "depth n" ends the search after n iterations, the depth the info lines
+# count. Infinite and ponder searches wait for stop, and searches on the
+# clock for the clock; anything else gets a fixed budget so it answers.
+def search_depth(fields:dict[str, str], clock:time_manager.SearchClock) -> int:
+    if "infinite" in fields:
+        return max_depth
+    if "depth" in fields:
+        iterations = max(int(fields["depth"]), 1)
+        return min(engine.first_iteration_depth * engine.iteration_growth ** (iterations - 1), 
+                   max_depth)
+    if "nodes" in fields:
+        return int(fields["nodes"])
+    if "ponder" in fields or clock.hard_limit is not None:
+        return max_depth
+    return default_depth
+
+# Tablebase wins are reported as this many centipawns less their distance
+# in plies, and other scores (hopeless positions included) are clamped to
+# max_cp.
+tablebase_win_cp = 20_000
+max_cp = 10_000
+
+# UCI scores are from the side to move's point of view, and mates are counted
+# in moves rather than plies.
+def score_field(score:float, turn:chess.Color) -> str:
+    relative = score if turn == chess.WHITE else -score
+    sign = 1 if relative > 0 else -1
+    mate_distance = engine.mate_distance(relative)
+    if mate_distance is not None:
+        mate_in = (mate_distance + 1) // 2
+        return f"mate {sign * mate_in}"
+    tablebase_distance = engine.tablebase_distance(relative)
+    if tablebase_distance is not None:
+        return f"cp {sign * (tablebase_win_cp - tablebase_distance)}"
+    return f"cp {max(-max_cp, min(int(round(relative)), max_cp))}"
+
+def nps_field(positions_explored:int, elapsed:float) -> str:
+    nps = int(positions_explored / elapsed) if elapsed > 0 else 0
+    return f"nodes {positions_explored} nps {nps} time {int(elapsed * 1000)}"
+
+# stdout and the log are written both by the stdin loop and by the search
+# thread, so every write goes through here
+class Output():
+    def __init__(self, f:TextIO):
+        self.f = f
+        self.lock = threading.Lock()
+
+    def input(self, input:str) -> None:
+        with self.lock:
+            self.f.write(input)
+
+    def emit(self, output:list[str], log:Optional[str]) -> None:
+        with self.lock:
+            for line in output:
+                self.f.write(f"# {line}\n")
+                print(line, flush=True)
+            self.f.write(f"+ log + {log}\n")
+            self.f.flush()
+
+    def info(self, line:str) -> None:
+        with self.lock:
+            self.f.write(f"# {line}\n")
+            print(line, flush=True)
+
+# Runs one search at a time on a worker thread, so the stdin loop can answer
+# isready and act on stop/quit while the engine thinks.
+class Searcher():
+    thread: Optional[threading.Thread]
+    clock: Optional[time_manager.SearchClock]
+    # what each search of the game leaves for the next, until ucinewgame
+    session: Optional[GameSession]
+
+    def __init__(self, output:Output):
+        self.output = output
+        self.thread = None
+        self.clock = None
+        self.session = None
+
+    # Made on the first search, so it gets the Hash set before it.
+    def game_session(self) -> GameSession:
+        size_mb = int(option_value("Hash"))
+        if self.session is None:
+            self.session = GameSession(size_mb)
+        else:
+            self.session.resize(size_mb)
+        return self.session
+
+    def new_game(self) -> None:
+        self.stop()
+        if self.session is not None:
+            self.session.new_game()
+
+    def close(self) -> None:
+        self.stop()
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def start(self, fields:dict[str, str], b:chess.Board) -> None:
+        self.stop()
+        self.clock = time_manager.allocate(fields, b.turn, int(option_value("Move Overhead")))
+        depth = search_depth(fields, self.clock)
+        self.thread = threading.Thread(target=self.search, 
+                                       args=(b.copy(), depth, self.clock), 
+                                       daemon=True)
+        self.thread.start()
+
+    def search(self, 
+               b:chess.Board, 
+               depth:int, 
+               clock:time_manager.SearchClock) -> None:
+        # The GUI waits for a bestmove whatever happens to the search, so if
+        # it fails we answer with the last finished iteration's move, or any
+        # legal move. 0000 is the null move, for when there is none.
+        fallback = next(iter(b.legal_moves), None)
+        line = f"bestmove {fallback.uci() if fallback is not None else '0000'}"
+        log = "search failed"
+
+        def on_progress() -> None:
+            self.output.info(f"info {nps_field(clock.positions_explored, clock.elapsed())}")
+
+        def on_iteration(iteration:int, 
+                         positions_explored:int, 
+                         res:engine.SearchRes, 
+                         pv:list[chess.Move]) -> None:
+            nonlocal line
+            line = f"bestmove {pv[0].uci()}"
+            score = engine.float_of_eval(res.sorted_moves)
+            self.output.info(f"info depth {iteration} "
+                             f"{nps_field(positions_explored, clock.elapsed())} "
+                             f"score {score_field(score, b.turn)} "
+                             f"pv {' '.join(move.uci() for move in pv)}")
+
+        if fallback is None:
+            self.output.emit([line], "no legal moves")
+            return
+        try:
+            clock.on_progress = on_progress
+            session = self.game_session()
+            profile_before = instrument.snapshot()
+            res, stats = parallel.go(b, 
+                                     depth, 
+                                     int(option_value("Threads")), 
+                                     clock=clock, 
+                                     on_iteration=on_iteration,
+                                     null_move=option_flag("NullMove"),
+                                     late_move_reductions=option_flag("LateMoveReductions"),
+                                     syzygy_path=option_path("SyzygyPath"),
+                                     session=session)
+            seconds = clock.elapsed()
+            clock.wait_while_pondering()
+            log = f"explored: {res.positions_explored} time: {clock.elapsed():.3f}"
+            best_move = engine.best_move_of_eval(res.sorted_moves)
+            line = bestmove_line(best_move, session.pv)
+        finally:
+            self.output.emit([line], log)
+        telemetry_file = option_path("TelemetryFile")
+        if telemetry_file is not None:
+            profile = instrument.since(profile_before) if instrument.enabled else None
+            telemetry.append(telemetry_file, 
+                             {"fen": b.fen(), 
+                              "best_move": best_move.uci(),
+                              **stats.report(res.positions_explored, seconds, profile)})
+        profile_file = option_path("ProfileFile")
+        if profile_file is not None and instrument.enabled:
+            instrument.write(profile_file, instrument.snapshot())
+
+    # The opponent played the move we were pondering on: the search carries
+    # on, on our clock.
+    def ponderhit(self) -> None:
+        if self.clock is not None:
+            self.clock.ponderhit()
+
+    # Returns once the search has sent its bestmove, if there was a search.
+    def stop(self) -> None:
+        if self.thread is None:
+            return
+        assert self.clock is not None
+        self.clock.stop()
+        self.thread.join()
+        self.thread = None
+        self.clock = None
+
+# The reply we expect, from the principal variation, is sent along for the
+# GUI to ponder on.
+def bestmove_line(best_move:chess.Move, pv:list[chess.Move]) -> str:
+    if len(pv) >= 2 and pv[0] == best_move:
+        return f"bestmove {best_move.uci()} ponder {pv[1].uci()}"
+    return f"bestmove {best_move.uci()}"
+
+# A move from the opening book, if one is set and has the position. Infinite
+# and ponder searches have to wait for stop, so they always search.
+def book_move(fields : dict[str, str], b:chess.Board) -> Optional[chess.Move]:
+    path = option_path("BookFile")
+    if path is None or "infinite" in fields or "ponder" in fields:
+        return None
+    return book.probe(path, b, int(option_value("BookDepth")))
+
+def go_response(fields : dict[str, str], b:chess.Board, searcher:Searcher) -> Response:
+    move = book_move(fields, b)
+    if move is not None:
+        searcher.stop()
+        return Response(False, [f"bestmove {move.uci()}"], b, "book move")
+    searcher.start(fields, b)
+    return Response(False, [], b, "search started")
+
+def dynamic_response(input:list[str], b:chess.Board, searcher:Searcher) -> Response:
     if input[0] == "position":
         return position_response(input)
     elif input[0] == "go":
-        return go_response(parse_go(input), b) 
+        return go_response(parse_go(input), b, searcher) 
+    elif input[0] == "setoption":
+        return setoption_response(input, b)
     
     raise ValueError(input)
 
-def create_response(input:list[str], b:chess.Board) -> Response:
+def create_response(input:list[str], b:chess.Board, searcher:Searcher) -> Response:
     if input[0] == "uci":
         res = ["id name my_bot", "id author diego"] \
             + [str(opt) for opt in options] \
                 + ["uciok"]
         return Response(False, res, b, None)
     elif input[0] == "quit":
+        searcher.close()
+        parallel.shutdown_pools()
+        book.close_books()
+        tablebase.close_tablebases()
         return Response(True, [], b, None)
     elif input[0] == "isready":
+        # start the helper processes now, rather than on the clock
+        threads = int(option_value("Threads"))
+        if threads > 1:
+            parallel.helper_pool(threads - 1)
         return Response(False, ["readyok"], b, None)
+    elif input[0] == "stop":
+        searcher.stop()
+        return Response(False, [], b, None)
+    elif input[0] == "ponderhit":
+        searcher.ponderhit()
+        return Response(False, [], b, "ponderhit")
     elif input[0] == "ucinewgame":
+        searcher.new_game()
         return Response(False, [], b, None)
     else:
-        return dynamic_response(input, b)
+        return dynamic_response(input, b, searcher)
 
 def main(log:str) -> None:
     with open(log, "w+") as f:
+        output = Output(f)
+        searcher = Searcher(output)
         b = chess.Board()
         for input in sys.stdin:
-            f.write(input)
-            res = create_response(input.strip().split(), b)
+            output.input(input)
+            if not input.strip():
+                continue
+            res = create_response(input.strip().split(), b, searcher)
             b = res.board
             if not res.quit:
-                for line in res.output:
-                    f.write(f"# {line}\n")
-                    print(line, flush=True)
-                f.write(f"+ log + {res.log}\n")
+                output.emit(res.output, res.log)
             else:
-                exit(0)
\ No newline at end of file
+                exit(0)
+        searcher.close()
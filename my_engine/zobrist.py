@@ -0,0 +1,103 @@
+import chess
+from chess.polyglot import POLYGLOT_RANDOM_ARRAY
+from my_engine.instrument import profile
+
+# Keys are the Polyglot ones, so an incrementally maintained key always equals
+# chess.polyglot.zobrist_hash of the same position.
+castling_keys : dict[chess.Square, int] = {
+    chess.H1: POLYGLOT_RANDOM_ARRAY[768],
+    chess.A1: POLYGLOT_RANDOM_ARRAY[769],
+    chess.H8: POLYGLOT_RANDOM_ARRAY[770],
+    chess.A8: POLYGLOT_RANDOM_ARRAY[771],
+}
+turn_key = POLYGLOT_RANDOM_ARRAY[780]
+
+def piece_key(square: chess.Square, piece_type: chess.PieceType, color: chess.Color) -> int:
+    return POLYGLOT_RANDOM_ARRAY[64 * ((piece_type - 1) * 2 + int(color)) + square]
+
+def castling_key(castling_rights: chess.Bitboard) -> int:
+    key = 0
+    for square, square_key in castling_keys.items():
+        if castling_rights & chess.BB_SQUARES[square]:
+            key ^= square_key
+    return key
+
+def ep_key(ep_square: chess.Square, turn: chess.Color, pawns: chess.Bitboard) -> int:
+    # Polyglot only hashes the en passant file when a pawn of the side to move
+    # could actually capture there.
+    if turn == chess.WHITE:
+        capturer_rank = chess.square_rank(ep_square) - 1
+    else:
+        capturer_rank = chess.square_rank(ep_square) + 1
+    ep_file = chess.square_file(ep_square)
+    for capturer_file in (ep_file - 1, ep_file + 1):
+        if 0 <= capturer_file <= 7 and \
+            pawns & chess.BB_SQUARES[chess.square(capturer_file, capturer_rank)]:
+            return POLYGLOT_RANDOM_ARRAY[772 + ep_file]
+    return 0
+
+def board_key(b: chess.Board) -> int:
+    key = 0
+    for square, piece in b.piece_map().items():
+        key ^= piece_key(square, piece.piece_type, piece.color)
+    key ^= castling_key(b.castling_rights)
+    if b.ep_square is not None:
+        key ^= ep_key(b.ep_square, b.turn, b.pawns & b.occupied_co[b.turn])
+    if b.turn == chess.WHITE:
+        key ^= turn_key
+    return key
+
+# Called before a null move is pushed. Returns the key of the position after
+# the side to move passes.
+def null_key_after(b: chess.Board, key: int) -> int:
+    key ^= turn_key
+    if b.ep_square is not None:
+        key ^= ep_key(b.ep_square, b.turn, b.pawns & b.occupied_co[b.turn])
+    return key
+
+# Called before [move] is pushed. Returns the key of the position after it.
+@profile
+def key_after(b: chess.Board, key: int, move: chess.Move) -> int:
+    from_square, to_square = move.from_square, move.to_square
+    color = b.turn
+    piece_type = b.piece_type_at(from_square)
+    assert piece_type is not None
+
+    key ^= turn_key
+    key ^= piece_key(from_square, piece_type, color)
+    key ^= piece_key(to_square, move.promotion or piece_type, color)
+
+    if b.ep_square is not None:
+        key ^= ep_key(b.ep_square, color, b.pawns & b.occupied_co[color])
+
+    castling_rights = b.castling_rights
+    if piece_type == chess.KING:
+        if abs(chess.square_file(from_square) - chess.square_file(to_square)) > 1:
+            rank = chess.square_rank(from_square)
+            if chess.square_file(to_square) == 6:
+                rook_from, rook_to = chess.square(7, rank), chess.square(5, rank)
+            else:
+                rook_from, rook_to = chess.square(0, rank), chess.square(3, rank)
+            key ^= piece_key(rook_from, chess.ROOK, color)
+            key ^= piece_key(rook_to, chess.ROOK, color)
+        new_castling_rights = castling_rights & \
+            ~(chess.BB_RANK_1 if color == chess.WHITE else chess.BB_RANK_8)
+    else:
+        new_castling_rights = castling_rights
+    new_castling_rights &= ~chess.BB_SQUARES[from_square] & ~chess.BB_SQUARES[to_square]
+    if new_castling_rights != castling_rights:
+        key ^= castling_key(castling_rights) ^ castling_key(new_castling_rights)
+
+    captured_type = b.piece_type_at(to_square)
+    if captured_type is not None:
+        key ^= piece_key(to_square, captured_type, not color)
+    elif piece_type == chess.PAWN and to_square == b.ep_square:
+        captured_square = chess.square(chess.square_file(to_square),
+                                       chess.square_rank(from_square))
+        key ^= piece_key(captured_square, chess.PAWN, not color)
+
+    if piece_type == chess.PAWN and abs(to_square - from_square) == 16:
+        ep_square = (from_square + to_square) // 2
+        key ^= ep_key(ep_square, not color, b.pawns & b.occupied_co[not color])
+
+    return key
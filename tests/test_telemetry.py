@@ -0,0 +1,13 @@
+import chess
+
+from my_engine import engine
+
+# White's rook takes the undefended queen, and the budget runs out well before
+# the captures and checks around it, so they have to be extended.
+def test_extensions_counted() -> None:
+    b = chess.Board("4k3/8/8/3q4/8/8/3R4/4K3 w - - 0 1")
+    res, stats = engine.go(b, 3000, engine.Ordering.LINEAR, leaf_mode=engine.LeafMode.EXTENSIONS)
+    assert engine.best_move_of_eval(res.sorted_moves) == chess.Move.from_uci("d2d5")
+    assert stats.extensions > 0
+    assert 0 < stats.moves_post_extensions <= res.positions_explored
+    assert stats.report(res.positions_explored, 1.)["extensions"]["taken"] == stats.extensions